@@ -0,0 +1,36 @@
+"""
+    Compare a benchmark result JSON (from pyhelp.debug_utils.benchmark.run_benchmark) against a baseline.
+    Exit with code 1 if any variant / size is significantly slower, so that it can gate CI jobs.
+
+    A run is a regression when its median is more than `threshold` slower than the baseline and
+    Welch's t-test over the repeated timings gives p < alpha.
+
+    Example Usage:
+    ```bash
+    pyhelp.bench_compare --baseline=<baseline>.json --current=<current>.json --threshold=0.05 --alpha=0.01
+    ```
+"""
+import sys
+
+from fire import Fire
+
+from pyhelp.debug_utils.benchmark import compare_benchmarks, has_regression
+
+
+def bench_compare(baseline:str,
+                  current:str,
+                  threshold:float=0.05,
+                  alpha:float=0.01):
+    rows = compare_benchmarks(baseline, current, threshold=threshold, alpha=alpha)
+    if has_regression(rows):
+        print("Performance regression detected.")
+        sys.exit(1)
+    print("No significant regression.")
+
+
+def main():
+    Fire(bench_compare)
+
+
+if __name__ == '__main__':
+    Fire(bench_compare)
@@ -0,0 +1,551 @@
+"""
+    Single pass conversion engine shared by the dataset command line tools.
+
+    A reader yields FrameRecord objects and every writer consumes each record, so a dataset is
+    read once for any number of outputs. Writers apply their own object filters.
+
+    Readers:  KittiReader (image_2 / label_2 of a KITTI directory), MmdetResultReader (mmdetection result pickle)
+    Writers:  CocoWriter (COCO json), CustomWriter (mmdetection "custom" json), KittiTxtWriter (KITTI label txt files)
+
+    ```python
+    reader = KittiReader(kitti_path, label_split_file=split_file, workers=8)
+    convert(reader, [CocoWriter("coco.json", KITTI_NAMES), CustomWriter("custom.json", KITTI_NAMES)])
+    ```
+
+    Example Usage:
+    ```bash
+    pyhelp.convert --kitti_path=<kitti_path>/training --coco_file=<coco>.json --custom_file=<custom>.json --workers=8 --timing
+    pyhelp.convert --kitti_path=<kitti_path>/training --custom_file=<custom_dir> --custom_format=npy
+    pyhelp.convert --mmdet_results=<results>.pkl --class_names="['Car', 'Pedestrian', 'Cyclist']" --kitti_dir=<output_label_dir>
+    ```
+    `--timing` prints the time spent reading and in every writer.
+"""
+import abc
+import os
+import pickle
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import tqdm
+from fire import Fire
+
+from pyhelp.utils.custom_arrays import CustomArrays
+from pyhelp.utils.image_size import ImageSizeCache, read_image_size
+from pyhelp.utils.json_stream import JsonListWriter, JsonObjectWriter, SpooledJsonList
+from pyhelp.utils.kitti import KittiCatalog, read_kitti_labels, read_split_ids
+from pyhelp.utils.manifest import FrameManifest
+from pyhelp.utils.parallel import ordered_map
+
+_stage_seconds:Dict[str, float] = {}
+
+
+@contextmanager
+def _stage(name:str):
+    """Accumulate the time spent in the block under name (reported by convert with show_timing)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_seconds[name] = _stage_seconds.get(name, 0.0) + time.perf_counter() - start
+
+
+KITTI_NAMES = ['Car', 'Van', 'Truck', 'Pedestrian', 'Person_sitting', 'Cyclist', 'Tram']
+
+
+class FrameRecord():
+    """One frame: image information and its objects.
+
+    names, bboxes ([left, top, right, bottom]), occluded and scores are aligned per object, as lists
+    (KittiReader) or numpy arrays (MmdetResultReader, which keeps the dtype of the results).
+    occluded is None when unknown, scores is None for ground truth.
+    """
+    __slots__ = ('key', 'frame_id', 'image_path', 'width', 'height', 'names', 'bboxes', 'occluded', 'scores')
+
+    def __init__(self, key:str, frame_id:int, image_path:Optional[str]=None, width:Optional[int]=None,
+                 height:Optional[int]=None, names:Sequence[str]=(), bboxes:Sequence=(),
+                 occluded:Optional[Sequence[int]]=None, scores:Optional[Sequence[float]]=None):
+        self.key = key
+        self.frame_id = frame_id
+        self.image_path = image_path
+        self.width = width
+        self.height = height
+        self.names = names
+        self.bboxes = bboxes
+        self.occluded = occluded
+        self.scores = scores
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+def _as_list(values):
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+class KittiReader():
+    """Frames of a KITTI directory having both an image and a label, paired by frame id.
+
+    Image sizes are read from the file headers (size_cache keeps them across runs), labels are
+    parsed in bulk into columns (label_cache keeps them). With a manifest, only frames added or
+    changed since the last run are read.
+    """
+    def __init__(self, kitti_path:str, label_split_file:Optional[str]=None, output_count:Optional[int]=None,
+                 workers:int=0, size_cache:Optional[str]=None, label_cache:Optional[str]=None,
+                 catalog_index:Optional[str]=None, manifest:Optional[str]=None):
+        catalog = KittiCatalog.open(kitti_path, index_file=catalog_index).labeled()
+        all_label_files = catalog.names('label')
+        if label_split_file is not None:
+            catalog = catalog.select_ids(read_split_ids(label_split_file))
+        if output_count is not None:
+            catalog = catalog.subset(np.arange(min(output_count, len(catalog))))
+        self.catalog = catalog
+        self.image_path = catalog.directory('image')
+        self.label_path = catalog.directory('label')
+        self.frames = list(zip(catalog.names('image'), catalog.names('label')))
+        self.workers = workers
+        self.size_cache = size_cache
+        self.label_cache = label_cache
+        self.manifest = None
+        if manifest is not None:
+            self.manifest = FrameManifest(manifest, options=dict(reader="kitti", kitti_path=kitti_path))
+            self.manifest.prune(all_label_files)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def selection(self)->List[Tuple[str, str]]:
+        """The selected frames in order, part of every output's manifest selection."""
+        return self.frames
+
+    def read(self, frames:List[Tuple[str, str]], label_cache:Optional[str]=None):
+        """Yield the FrameRecord of the frames (image file, label file) in order."""
+        abs_image_paths = [os.path.join(self.image_path, image_file) for image_file, _ in frames]
+        with _stage("read.labels"):
+            labels = read_kitti_labels(self.label_path, [label_file for _, label_file in frames],
+                                       workers=self.workers, cache_file=label_cache)
+            names, occluded, bboxes = labels['type'], labels['occluded'], labels['bbox']
+            offsets = labels.offsets.tolist()
+        if self.size_cache is not None:
+            with _stage("read.sizes"):
+                cache = ImageSizeCache(self.size_cache)
+                sizes = cache.sizes(abs_image_paths, workers=self.workers)
+                cache.save()
+        else:
+            sizes = ordered_map(read_image_size, abs_image_paths, workers=self.workers) # type: ignore
+
+        for i, ((image_file, label_file), abs_image_path, (width, height)) in enumerate(zip(frames, abs_image_paths, sizes)):
+            start, end = offsets[i], offsets[i + 1] # only the frame's slice becomes python values
+            yield FrameRecord(label_file, int(image_file.split(".")[0]), abs_image_path, width, height,
+                              names[start:end].tolist(), bboxes[start:end].tolist(), occluded[start:end].tolist())
+
+    def records(self):
+        """Iterator of the FrameRecord of every frame (the manifest is checked on call)."""
+        if self.manifest is None:
+            return self.read(self.frames, self.label_cache)
+        return self.manifest.records(
+            [label_file for _, label_file in self.frames],
+            [os.path.join(self.label_path, label_file) for _, label_file in self.frames],
+            [os.path.join(self.image_path, image_file) for image_file, _ in self.frames],
+            lambda indices: self.read([self.frames[i] for i in indices]))
+
+
+class MmdetResultReader():
+    """Frames of an mmdetection result pickle: a list (one per sample) of per class [num_objects, 5] arrays
+    ([left, top, right, bottom, score]). Only the classes in class_names are read (in that order).
+    frame_ids: id of every sample, defaults to the sample index.
+    """
+    def __init__(self, pickle_file_path:str, class_names:Sequence[str], frame_ids:Optional[Sequence[int]]=None):
+        with open(pickle_file_path, 'rb') as f:
+            self.results = pickle.load(f)
+        self.class_names = list(class_names)
+        self.frame_ids = list(range(len(self.results))) if frame_ids is None else list(frame_ids)
+        if len(self.frame_ids) != len(self.results):
+            raise ValueError(f"{pickle_file_path} has {len(self.results)} samples but {len(self.frame_ids)} frame ids are given")
+        self.manifest = None
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def selection(self)->List[int]:
+        return self.frame_ids
+
+    def records(self):
+        for i, result_array_list in enumerate(self.results):
+            arrays = [results for _, results in zip(self.class_names, result_array_list)]
+            counts = [len(results) for results in arrays]
+            objects = np.concatenate(arrays) if sum(counts) else np.zeros((0, 5), dtype=np.float32)
+            names = np.repeat(np.array(self.class_names[:len(arrays)], dtype=str), counts)
+            yield FrameRecord(str(i), self.frame_ids[i], names=names, bboxes=objects[:, :4], scores=objects[:, 4])
+
+
+class Writer(abc.ABC):
+    """Base of the writers: open, write(record) for every frame, close.
+    output and selection (the writer options) identify the output for the manifest, together with the
+    selection of the reader (a writer whose output is up to date is skipped)."""
+    name = "writer"
+
+    def __init__(self, output:str):
+        self.output = output
+
+    @property
+    def selection(self)->Any:
+        return None
+
+    @property
+    def output_file(self)->str:
+        """File checked by the manifest, the last one written."""
+        return self.output
+
+    def open(self)->None:
+        pass
+
+    @abc.abstractmethod
+    def write(self, record:FrameRecord):
+        pass
+
+    def close(self):
+        pass
+
+
+class CocoWriter(Writer):
+    """COCO detection json, images and annotations are streamed (annotations spooled to a temporary file).
+    Objects of other classes or occluded more than max_occlusion are dropped, category ids start at 1."""
+    name = "coco"
+
+    def __init__(self, output_file:str, class_names:Sequence[str]=KITTI_NAMES, info:Optional[Dict[str, Any]]=None,
+                 float_precision:Optional[int]=None, max_occlusion:int=2):
+        super().__init__(output_file)
+        self.class_names = list(class_names)
+        self.class_index = {name: index for index, name in enumerate(self.class_names)}
+        self.info = info if info is not None else {}
+        self.float_precision = float_precision
+        self.max_occlusion = max_occlusion
+        self.manifest:Optional[FrameManifest] = None
+
+    @property
+    def selection(self):
+        return (self.class_names, self.info, self.float_precision, self.max_occlusion)
+
+    def open(self)->None:
+        self.file = open(self.output, 'w')
+        self.annotations = SpooledJsonList(self.float_precision)
+        self.writer = JsonObjectWriter(self.file, self.float_precision)
+        self.writer.write_field("info", self.info)
+        self.images = self.writer.begin_list("images")
+        self.global_annotation_id = 0
+
+    def write(self, record:FrameRecord):
+        image_obj:Dict[str, Union[str, int, float]] = {
+            "id":record.frame_id,
+        }
+        image_obj["width"] = record.width # type: ignore
+        image_obj["height"] = record.height # type: ignore
+        image_obj["file_name"] = record.image_path # type: ignore
+        self.images.write(image_obj)
+
+        occluded = record.occluded if record.occluded is not None else [0] * len(record.names)
+        objects = []
+        for name, occlusion, bbox in zip(_as_list(record.names), _as_list(occluded), _as_list(record.bboxes)):
+            # as in KITTI evaluation script, KITTI will filter out objects with oclude > 2 even for hard-estimation
+            if name not in self.class_index or occlusion > self.max_occlusion:
+                continue
+            objects.append((self.class_index[name] + 1, bbox)) # Notice the first index is expected to be background
+        annotation_ids:Sequence[int]
+        if self.manifest is not None:
+            annotation_ids = self.manifest.ids(record.key, len(objects))
+        else:
+            annotation_ids = range(self.global_annotation_id, self.global_annotation_id + len(objects))
+        self.global_annotation_id += len(objects)
+
+        for annotation_id, (label_id, bbox) in zip(annotation_ids, objects):
+            coco_bbox = [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]]
+            cocodet_label:Dict[str, Union[int, float, List, str]] = {}
+            cocodet_label["id"] = annotation_id
+            cocodet_label["category_id"] = label_id
+            cocodet_label["image_id"] = image_obj["id"]
+            cocodet_label["area"] = coco_bbox[2] * coco_bbox[3]
+            cocodet_label["segmentation"] = []
+            cocodet_label["bbox"] = coco_bbox
+            cocodet_label["iscrowd"] = 0
+            self.annotations.write(cocodet_label)
+
+    def close(self):
+        self.images.close()
+        self.writer.write_spooled_list("annotations", self.annotations) # after the images, same key order as json.dump
+        self.writer.write_field("categories", [{"id":index+1, "name":item} for index, item in enumerate(self.class_names)])
+        self.writer.close()
+        self.annotations.close()
+        self.file.close()
+
+
+class CustomWriter(Writer):
+    """mmdetection "custom" annotations, objects of other classes are dropped.
+
+    output_format:
+        json: json list, bboxes and labels as lists (float_precision applies)
+        pkl: pickle of the list, bboxes as float32 [n, 4] and labels as int64 [n] arrays, loadable by mmcv.load
+        npy: directory of concatenated arrays with per-image offsets, see pyhelp.utils.custom_arrays
+    """
+    name = "custom"
+    OUTPUT_FORMATS = ('json', 'pkl', 'npy')
+
+    def __init__(self, output_file:str, class_names:Sequence[str]=KITTI_NAMES, float_precision:Optional[int]=None,
+                 output_format:str='json'):
+        super().__init__(output_file)
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError(f"output_format should be one of {self.OUTPUT_FORMATS}, got {output_format}")
+        self.class_names = list(class_names)
+        self.class_index = {name: index for index, name in enumerate(self.class_names)}
+        self.float_precision = float_precision
+        self.output_format = output_format
+
+    @property
+    def selection(self):
+        return (self.class_names, self.float_precision, self.output_format)
+
+    @property
+    def output_file(self):
+        if self.output_format == 'npy':
+            return os.path.join(self.output, 'meta.json') # written last
+        return self.output
+
+    def open(self)->None:
+        if self.output_format == 'json':
+            self.file = open(self.output, 'w')
+            self.writer = JsonListWriter(self.file, self.float_precision)
+        else:
+            self.records:List[Dict[str, Any]] = []
+
+    def write(self, record:FrameRecord):
+        json_object:Dict[str, Any] = dict()
+        json_object['filename'] = record.image_path
+        json_object['height'] = record.height
+        json_object['width']  = record.width
+        bboxes = []
+        labels = []
+        for name, bbox in zip(_as_list(record.names), _as_list(record.bboxes)):
+            if name in self.class_index:
+                labels.append(self.class_index[name] + 1) # Notice the first index is expected to be background
+                bboxes.append(bbox)
+        json_object['ann'] = {
+            "bboxes":bboxes, "labels":labels
+        }
+        if self.output_format == 'json':
+            self.writer.write(json_object)
+        else:
+            self.records.append(json_object)
+
+    def close(self):
+        if self.output_format == 'json':
+            self.writer.close()
+            self.file.close()
+            return
+        annotations = CustomArrays.from_records(self.records)
+        self.records = []
+        if self.output_format == 'npy':
+            annotations.save(self.output)
+        else:
+            with open(self.output, 'wb') as f:
+                pickle.dump(annotations.to_records(), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+KITTI_LINE = "%s -1 -1 -10 %r %r %r %r -1 -1 -1 -1000 -1000 -1000 -10\n"
+KITTI_RESULT_LINE = "%s -1 -1 -10 %r %r %r %r -1 -1 -1 -1000 -1000 -1000 -10 %r\n"
+
+
+def kitti_txt_lines(names:Sequence[str], bboxes:Sequence, scores:Optional[Sequence[float]]=None)->str:
+    """KITTI label lines of the objects, without the score column if scores is None.
+
+    Values are cast to float64 as whole columns and printed as the repr of the Python floats, the same
+    text as str.format of the numpy float32 / float64 scalars, about twice as fast.
+    """
+    columns = [_as_list(names)] + np.asarray(bboxes, dtype=np.float64).reshape(-1, 4).T.tolist()
+    if scores is None:
+        return ''.join(map(KITTI_LINE.__mod__, zip(*columns)))
+    columns.append(np.asarray(scores, dtype=np.float64).reshape(-1).tolist())
+    return ''.join(map(KITTI_RESULT_LINE.__mod__, zip(*columns)))
+
+
+def _write_text(file_path:str, text:str):
+    with open(file_path, 'w') as file:
+        file.write(text)
+
+
+class KittiTxtWriter(Writer):
+    """One KITTI label file per frame (<frame_id>.txt, %06d) with the 2D boxes, unknown values are the
+    KITTI defaults. Objects scoring at most score_threshold are dropped, records without scores are
+    written without the score column.
+    Lines are formatted in this thread, the files are written by a pool of threads (0 writes them here)."""
+    name = "kitti"
+    MAX_PENDING = 1024 # files queued before waiting for the writes
+
+    def __init__(self, output_dir:str, score_threshold:Optional[float]=None, threads:int=8):
+        super().__init__(output_dir)
+        self.score_threshold = score_threshold
+        self.threads = threads
+
+    @property
+    def selection(self):
+        return self.score_threshold
+
+    def open(self)->None:
+        if not os.path.isdir(self.output):
+            os.mkdir(self.output)
+        self.executor = ThreadPoolExecutor(self.threads) if self.threads > 0 else None
+        self.pending:List[Future] = []
+
+    def write(self, record:FrameRecord):
+        file_path = os.path.join(self.output, "%06d.txt" % record.frame_id)
+        names:Any = record.names
+        bboxes:Any = record.bboxes
+        scores:Any = record.scores
+        if scores is not None and self.score_threshold is not None:
+            keep = np.asarray(scores) > self.score_threshold
+            names = np.asarray(names)[keep]
+            bboxes = np.asarray(bboxes).reshape(-1, 4)[keep]
+            scores = np.asarray(scores)[keep]
+        text = kitti_txt_lines(names, bboxes, scores)
+        if self.executor is None:
+            _write_text(file_path, text)
+            return
+        self.pending.append(self.executor.submit(_write_text, file_path, text))
+        if len(self.pending) >= self.MAX_PENDING:
+            self._wait()
+
+    def _wait(self):
+        for future in self.pending:
+            future.result() # raises the error of a failed write
+        self.pending = []
+
+    def close(self):
+        if self.executor is not None:
+            try:
+                self._wait()
+            finally:
+                self.executor.shutdown()
+
+
+def convert(reader, writers:Sequence[Writer], show_timing:bool=False):
+    """Stream the records of reader through all writers in one pass.
+
+    With a manifest on the reader, writers whose output is up to date (no frame changed, same selection,
+    file not modified) are skipped. show_timing prints the time spent reading and in every writer.
+    """
+    _stage_seconds.clear()
+    manifest = reader.manifest
+    for writer in writers:
+        if isinstance(writer, CocoWriter):
+            writer.manifest = manifest # stable annotation ids
+
+    with _stage("read"):
+        records = iter(reader.records())
+    active = []
+    selections = {writer.output_file: (reader.selection, writer.selection) for writer in writers}
+    for writer in writers:
+        if manifest is not None and manifest.is_output_current(writer.output_file, selections[writer.output_file]):
+            print("Nothing changed, %s is up to date" % writer.output)
+        else:
+            active.append(writer)
+
+    if active:
+        for writer in active:
+            writer.open()
+        progress = tqdm.tqdm(total=len(reader))
+        try:
+            while True:
+                with _stage("read"):
+                    record = next(records, None)
+                if record is None:
+                    break
+                for writer in active:
+                    with _stage("write." + writer.name):
+                        writer.write(record)
+                progress.update()
+        finally:
+            progress.close()
+            for writer in active:
+                with _stage("write." + writer.name):
+                    writer.close()
+        if manifest is not None:
+            for writer in active:
+                manifest.set_output(writer.output_file, selections[writer.output_file])
+
+    if manifest is not None:
+        manifest.save()
+        print("Converted %d frames, %d reused from the manifest" % (manifest.num_converted, manifest.num_hits))
+    if show_timing:
+        for name, seconds in _stage_seconds.items():
+            print("%-16s %8.3f s" % (name, seconds))
+
+
+def convert_dataset(kitti_path:Optional[str]=None,
+                    mmdet_results:Optional[str]=None,
+                    coco_file:Optional[str]=None,
+                    custom_file:Optional[str]=None,
+                    custom_format:str='json',
+                    kitti_dir:Optional[str]=None,
+                    class_names:Optional[List[str]]=None,
+                    label_split_file:Optional[str]=None,
+                    output_count:Optional[int]=None,
+                    score_threshold:float=0.4,
+                    workers:int=0,
+                    size_cache:Optional[str]=None,
+                    label_cache:Optional[str]=None,
+                    catalog_index:Optional[str]=None,
+                    manifest:Optional[str]=None,
+                    float_precision:Optional[int]=None,
+                    timing:bool=False):
+    """
+        Convert a KITTI directory (kitti_path) or mmdetection results (mmdet_results) into every given output
+        in a single pass: coco_file (COCO json), custom_file (mmdetection custom, custom_format json / pkl / npy),
+        kitti_dir (KITTI txt).
+        class_names: classes written, defaults to the 7 KITTI classes (Car ... Tram) for KITTI input;
+            for mmdet_results they name the result classes (default ['Car', 'Pedestrian', 'Cyclist']).
+        With mmdet_results, kitti_path/label_split_file optionally give the frame ids of the samples.
+    """
+    if mmdet_results is not None:
+        class_names = class_names or ['Car', 'Pedestrian', 'Cyclist']
+        frame_ids = None
+        if kitti_path is not None:
+            catalog = KittiCatalog.open(kitti_path, index_file=catalog_index)
+            catalog = catalog.subset(catalog.has('image'))
+            if label_split_file is not None:
+                catalog = catalog.select_ids(read_split_ids(label_split_file))
+            frame_ids = catalog.ids.tolist()
+        reader:Any = MmdetResultReader(mmdet_results, class_names, frame_ids)
+    elif kitti_path is not None:
+        class_names = class_names or KITTI_NAMES
+        reader = KittiReader(kitti_path, label_split_file, output_count, workers=workers, size_cache=size_cache,
+                             label_cache=label_cache, catalog_index=catalog_index, manifest=manifest)
+    else:
+        raise ValueError("Either kitti_path or mmdet_results is needed")
+
+    writers:List[Writer] = []
+    if coco_file is not None:
+        info = {"description":"Converted by pyhelp.convert from {}".format(mmdet_results or kitti_path)}
+        writers.append(CocoWriter(coco_file, class_names, info, float_precision))
+    if custom_file is not None:
+        writers.append(CustomWriter(custom_file, class_names, float_precision, custom_format))
+    if kitti_dir is not None:
+        writers.append(KittiTxtWriter(kitti_dir, score_threshold if mmdet_results is not None else None))
+    if not writers:
+        raise ValueError("No output given, set coco_file, custom_file and / or kitti_dir")
+    print("The number of output image will be %d" % len(reader))
+    convert(reader, writers, show_timing=timing)
+
+
+def main():
+    Fire(convert_dataset)
+
+
+if __name__ == '__main__':
+    Fire(convert_dataset)
@@ -5,7 +5,9 @@ def main():
         "pyhelp.pydocs": "pyhelp.cli.read_docs",
         "pyhelp.kitti2coco" : "pyhelp.cli.kitti2coco",
         "pyhelp.kitti2custom" : "pyhelp.cli.kitti2custom",
-        "pyhelp.mmdet2kitti" : "pyhelp.cli.mmdet2kitti"
+        "pyhelp.mmdet2kitti" : "pyhelp.cli.mmdet2kitti",
+        "pyhelp.convert" : "pyhelp.cli.engine",
+        "pyhelp.bench_compare" : "pyhelp.cli.bench_compare"
     }
     if len(sys.argv) < 2 or '-h' in sys.argv or '--help' in sys.argv:
         print("Watch command line helping by typing: 'pyhelp <key>' in command line \n")
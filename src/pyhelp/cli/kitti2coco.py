@@ -60,121 +60,56 @@
     ```bash
         pyhelp.kitti2coco --kitti_path=<kitti_path>/training(test) --output_file=<output_path>.json --label_split_file=<path/to/splitfile.txt or None or omitted> --output_count
     ```
+    With `--workers=N` the frames are read by N processes, the output is identical to the serial run.
+    Image sizes are read from the file headers, `--size_cache=<path>.json` keeps them across runs.
+    Labels are parsed in bulk into numpy columns (pyhelp.utils.kitti), `--label_cache=<path>.npz` keeps them across runs.
+    Images and labels are paired by frame id and the split file lists frame ids, `--catalog_index=<path>.npz`
+    keeps the directory scan across runs.
+    Images and annotations are streamed to the output file, `--float_precision=N` rounds the floats to N decimals.
+    With `--manifest=<path>.pkl` the converted frames are cached, later runs only convert added or changed
+    frames; annotation ids of unchanged frames stay the same (and are no longer consecutive after changes).
 """
 
 from fire import Fire
-import json
-import os
-from PIL import Image
-import tqdm
 import datetime
-from typing import Union, List, Dict, Any
-
-KITTI_NAMES = ['Car', 'Van', 'Truck', 'Pedestrian', 'Person_sitting', 'Cyclist', 'Tram']
-
-def read_label_split_file(label_split_file:Union[None, str],
-                          num_total_file:int)->List[bool]:
-    if label_split_file is None:
-        return [True for _ in range(num_total_file)]
-    
-    selection_mask = [False for _ in range(num_total_file)]
-    with open(label_split_file, 'r') as f:
-        for line in f.readlines():
-            if line.strip():
-                index_num = int(line.strip())
-                selection_mask[index_num] = True
-    return selection_mask
+from typing import Union
+from pyhelp.cli.engine import KITTI_NAMES, KittiReader, CocoWriter, convert
 
 
 def kitti2COCO(kitti_path:str, 
                  output_file:str,
                  label_split_file:Union[None, str]=None,
-                 output_count:int=10):
+                 output_count:int=10,
+                 workers:int=0,
+                 size_cache:Union[None, str]=None,
+                 float_precision:Union[None, int]=None,
+                 manifest:Union[None, str]=None,
+                 label_cache:Union[None, str]=None,
+                 catalog_index:Union[None, str]=None):
     """
         transform kitti labels to coco dataset format
         Args:
             kitti_path: path to KITTI training or test set 
             output_path: output file path to json file of the output dataset
+            workers: number of processes reading the frames, 0 reads them in this process
+            size_cache: json file caching the image sizes by path and mtime, None to disable
+            float_precision: round floats of the output to this many decimals, None keeps the full repr
+            manifest: pickle file caching the converted frames for incremental runs, None to disable
+            label_cache: npz file caching the parsed labels of the selected frames, None to disable
+            catalog_index: npz file caching the frame catalog of kitti_path, None to disable
     """
-    ## Set up KITTI path and objects
-    image_path = os.path.join(kitti_path, "image_2")
-    label_path = os.path.join(kitti_path, "label_2")
-
-    image_files = os.listdir(image_path)
-    label_files = os.listdir(label_path)
-    image_files.sort()
-    label_files.sort()
-
-    mask = read_label_split_file(label_split_file, len(image_files))
-    image_files = [image_files[i] for i in range(len(image_files)) if mask[i]]
-    label_files = [label_files[i] for i in range(len(label_files)) if mask[i]]
-    
-    ## Set up custom path and objects
-    if output_count > len(image_files):
-        output_count = len(image_files)
+    ## frames with both an image and a label, paired by frame id
+    reader = KittiReader(kitti_path, label_split_file, output_count, workers=workers, size_cache=size_cache,
+                         label_cache=label_cache, catalog_index=catalog_index, manifest=manifest)
+    output_count = len(reader)
     print("The number of output image will be %d" % output_count)
 
-    ## Set up basic info and formats for coco data
-    output_json:Dict[str, Any] = {}
-    output_json["info"] = {
+    ## Set up basic info for coco data
+    info = {
         "year" : datetime.datetime.now().year,
         "description" : "Transformed from KITTI dataset with kitti_path:{}; output_path:{}, label_split_file:{}, output_count:{}".format(kitti_path, output_file, label_split_file, output_count),
     }
-    output_json["images"] = []
-    output_json["annotations"] = []
-    output_json["categories"] = []
-    for index, item in enumerate(KITTI_NAMES):
-        output_json["categories"].append(
-            {
-                "id":index+1,
-                "name":item
-            }
-        )
-
-    global_annotation_id = 0
-    for image_file, label_file in tqdm.tqdm(zip(image_files[:output_count], label_files[:output_count])):
-        abs_image_path = os.path.join(image_path, image_file)
-        abs_label_path = os.path.join(label_path, label_file)
-
-        image_obj:Dict[str, Union[str, int, float]] = {
-            "id":int(image_file.split(".")[0]),
-        }
-
-        # read image
-        image = Image.open(abs_image_path)
-        width, height =image.size
-        image_obj["width"] = width
-        image_obj["height"] = height
-        image_obj["file_name"] = abs_image_path
-        output_json["images"].append(image_obj)
-
-        # read label
-        with open(abs_label_path, 'r') as file:
-            for line in file.readlines():
-                splits = line.split(' ')
-                cls_ = splits[0]
-                if cls_ not in KITTI_NAMES or float(splits[2]) > 2:
-                    continue
-                label_id = KITTI_NAMES.index(cls_) + 1 # Notice the first index is expected to be background
-                
-                bbox = [float(splits[i]) for i in range(4, 8)] #[left top right bottom]
-                coco_bbox = [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]]
-                cocodet_label:Dict[str, Union[int, float, List, str]] = {}
-                cocodet_label["id"] = global_annotation_id
-                cocodet_label["category_id"] = label_id
-                cocodet_label["image_id"] = image_obj["id"]
-                cocodet_label["area"] = coco_bbox[2] * coco_bbox[3]
-                cocodet_label["segmentation"] = []
-                cocodet_label["bbox"] = coco_bbox
-                cocodet_label["iscrowd"] = 0 # as in KITTI evaluation script, KITTI will filter out objects with oclude > 2 even for hard-estimation
-                output_json["annotations"].append(cocodet_label)
-                global_annotation_id += 1
-
-
-        # bboxes = np.array(bboxes).reshape(-1, 4)
-        # labels = np.array(labels).reshape(-1)
-
-    json.dump(output_json, open(output_file, 'w'))
+    convert(reader, [CocoWriter(output_file, KITTI_NAMES, info, float_precision)])
 
 
 def main():
@@ -51,92 +51,54 @@
     ```bash
         pyhelp.kitti2custom --kitti_path=<kitti_path>/training(test) --output_file=<output_path>.json --label_split_file=<path/to/splitfile.txt or None or omitted> --output_count
     ```
+    With `--workers=N` the frames are read by N processes, the output is identical to the serial run.
+    Image sizes are read from the file headers, `--size_cache=<path>.json` keeps them across runs.
+    Labels are parsed in bulk into numpy columns (pyhelp.utils.kitti), `--label_cache=<path>.npz` keeps them across runs.
+    Images and labels are paired by frame id and the split file lists frame ids, `--catalog_index=<path>.npz`
+    keeps the directory scan across runs.
+    Records are streamed to the output file, `--float_precision=N` rounds the floats to N decimals.
+    With `--manifest=<path>.pkl` the converted frames are cached, later runs only convert added or changed frames.
+    `--output_format=pkl` writes the list above with numpy bboxes (float32) and labels (int64) as a pickle (mmcv.load),
+    `--output_format=npy` writes a directory at output_file with all boxes and labels concatenated and per-image offsets,
+    loaded instantly (optionally memory mapped) by pyhelp.utils.custom_arrays.CustomArrays.load(output_file, mmap=True).
 """
 from fire import Fire
-import json
-import os
-import cv2
-import tqdm
-from typing import Union, List, Dict, Any
-
-KITTI_NAMES = ['Car', 'Van', 'Truck', 'Pedestrian', 'Person_sitting', 'Cyclist', 'Tram']
-
-def read_label_split_file(label_split_file:Union[None, str],
-                          num_total_file:int)->List[bool]:
-    if label_split_file is None:
-        return [True for _ in range(num_total_file)]
-    
-    selection_mask = [False for _ in range(num_total_file)]
-    with open(label_split_file, 'r') as f:
-        for line in f.readlines():
-            if line.strip():
-                index_num = int(line.strip())
-                selection_mask[index_num] = True
-    return selection_mask
+from typing import Union
+from pyhelp.cli.engine import KITTI_NAMES, KittiReader, CustomWriter, convert
 
 
 def kitti2custom(kitti_path:str, 
                  output_file:str,
                  label_split_file:Union[None, str]=None,
-                 output_count:int=10):
+                 output_count:int=10,
+                 workers:int=0,
+                 size_cache:Union[None, str]=None,
+                 float_precision:Union[None, int]=None,
+                 manifest:Union[None, str]=None,
+                 label_cache:Union[None, str]=None,
+                 catalog_index:Union[None, str]=None,
+                 output_format:str='json'):
     """transform kitti labels to 'custom' dataset of mmdetection
 
     Args:
         kitti_path (str): path to KITTI training or test set 
         output_file (str): output file path to json file of the output dataset
-        label_split_file (Union[None, str], optional): split_file. Defaults to None, all-true.
+        label_split_file (Union[None, str], optional): split file listing frame ids. Defaults to None, all frames.
         output_count (int, optional): set the upper bound of the output data size. Defaults to 10.
-    """                 
-    ## Set up KITTI path and objects
-    image_path = os.path.join(kitti_path, "image_2")
-    label_path = os.path.join(kitti_path, "label_2")
-
-    image_files = os.listdir(image_path)
-    label_files = os.listdir(label_path)
-    image_files.sort()
-    label_files.sort()
-
-    mask = read_label_split_file(label_split_file, len(image_files))
-    image_files = [image_files[i] for i in range(len(image_files)) if mask[i]]
-    label_files = [label_files[i] for i in range(len(label_files)) if mask[i]]
-    
-    ## Set up custom path and objects
-    if output_count > len(image_files):
-        output_count = len(image_files)
-    print("The number of output image will be %d" % output_count)
-    output_json = []
-    for image_file, label_file in tqdm.tqdm(zip(image_files[:output_count], label_files[:output_count])):
-        abs_image_path = os.path.join(image_path, image_file)
-        abs_label_path = os.path.join(label_path, label_file)
-
-        json_object:Dict[str, Any] = dict()
-        json_object['filename'] = abs_image_path
-
-        # read image size
-        image = cv2.imread(abs_image_path)
-        height, width = image.shape[0], image.shape[1]
-        json_object['height'] = height
-        json_object['width']  = width
+        workers (int, optional): number of processes reading the frames. Defaults to 0, read in this process.
+        size_cache (Union[None, str], optional): json file caching the image sizes by path and mtime. Defaults to None.
+        float_precision (Union[None, int], optional): round floats of the output to this many decimals. Defaults to None, full repr.
+        manifest (Union[None, str], optional): pickle file caching the converted frames for incremental runs. Defaults to None.
+        label_cache (Union[None, str], optional): npz file caching the parsed labels of the selected frames. Defaults to None.
+        catalog_index (Union[None, str], optional): npz file caching the frame catalog of kitti_path. Defaults to None.
+        output_format (str, optional): 'json', 'pkl' (ndarray records) or 'npy' (array directory at output_file). Defaults to 'json'.
+    """
+    ## frames with both an image and a label, paired by frame id
+    reader = KittiReader(kitti_path, label_split_file, output_count, workers=workers, size_cache=size_cache,
+                         label_cache=label_cache, catalog_index=catalog_index, manifest=manifest)
+    print("The number of output image will be %d" % len(reader))
+    convert(reader, [CustomWriter(output_file, KITTI_NAMES, float_precision, output_format)])
 
-        # read label
-        bboxes = []
-        labels = []
-        with open(abs_label_path, 'r') as file:
-            for line in file.readlines():
-                splits = line.split(' ')
-                cls_ = splits[0]
-                if cls_ not in KITTI_NAMES:
-                    continue
-                labels.append(KITTI_NAMES.index(cls_) + 1) # Notice the first index is expected to be background
-                bbox = [float(splits[i]) for i in range(4, 8)]
-                bboxes.append(bbox)
-        # bboxes = np.array(bboxes).reshape(-1, 4)
-        # labels = np.array(labels).reshape(-1)
-        json_object['ann'] = {
-            "bboxes":bboxes, "labels":labels
-        }
-        output_json.append(json_object)
-    json.dump(output_json, open(output_file, 'w'))
 
 def main():
     Fire(kitti2custom)
@@ -15,33 +15,36 @@
     ```bash
     pyhelp.mmdet2kitti --pickle_file_path=<path_to_pkl>.pkl --output_dir_path=<path_to_outputlabel_dir> --score_threshold=0.4
     ```
+    Output files are named after the sample index (%06d.txt). If the samples are the frames of a KITTI
+    directory (optionally a split), pass `--kitti_path=<kitti_path>/testing --label_split_file=<split.txt>`
+    to name them after the frame ids instead.
+    Thresholding and formatting are done per sample on whole columns, the files are written by `--threads=N`
+    threads (default 8, 0 writes them in the main thread); the output does not depend on N.
 """
 
 from fire import Fire
-import pickle
-import os
-import tqdm
+from typing import Optional
+from pyhelp.utils.kitti import KittiCatalog, read_split_ids
+from pyhelp.cli.engine import MmdetResultReader, KittiTxtWriter, convert
 def mmdet2kitti(pickle_file_path:str,
                 output_dir_path:str,
                 score_threshold:float=0.4,
-                class_names:list=['Car', 'Pedestrian', 'Cyclist']):
-    result_object = pickle.load(open(pickle_file_path, 'rb'))
-    if not os.path.isdir(output_dir_path):
-        os.mkdir(output_dir_path)
-    for i in tqdm.tqdm(range(len(result_object))):
-        file_path = os.path.join(output_dir_path, "%06d.txt" % i)
-        result_array_list = result_object[i]
-        with open(file_path, 'w') as file:
-            lines_to_write = []
-            for class_name, results in zip(class_names, result_array_list):
-                # results : [num_objects, 5]
-                strong_results = results[results[:, 4] > score_threshold] #[num_objects, 5]
-                for obj in strong_results:
-                    lines_to_write.append("{} -1 -1 -10 {} {} {} {} -1 -1 -1 -1000 -1000 -1000 -10 {}\n".format(
-                        class_name, obj[0], obj[1], obj[2], obj[3], obj[4]
-                    )
-                    )
-            file.writelines(lines_to_write)
+                class_names:list=['Car', 'Pedestrian', 'Cyclist'],
+                kitti_path:Optional[str]=None,
+                label_split_file:Optional[str]=None,
+                catalog_index:Optional[str]=None,
+                threads:int=8):
+    reader = MmdetResultReader(pickle_file_path, class_names)
+    if kitti_path is not None:
+        catalog = KittiCatalog.open(kitti_path, index_file=catalog_index)
+        catalog = catalog.subset(catalog.has('image'))
+        if label_split_file is not None:
+            catalog = catalog.select_ids(read_split_ids(label_split_file))
+        if len(catalog) != len(reader):
+            raise ValueError(f"{pickle_file_path} has {len(reader)} samples but {kitti_path} selects {len(catalog)} frames")
+        reader.frame_ids = catalog.ids.tolist()
+    convert(reader, [KittiTxtWriter(output_dir_path, score_threshold, threads)])
+
 
 def main():
     Fire(mmdet2kitti)
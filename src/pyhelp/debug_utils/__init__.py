@@ -1,3 +1,6 @@
-from .pyplot import imshow
-from .timing import profiler, timer
-from .data_io import save_data, load_data
\ No newline at end of file
+from .pyplot import (imshow, LiveImshow, points_to_bev, points_to_range_image,
+                     draw_boxes, overlay_boxes)
+from .timing import profiler, timer, measure
+from .data_io import save_data, load_data
+from .export import export_sequence
+from .memory import memprof, memory_profile
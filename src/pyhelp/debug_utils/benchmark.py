@@ -0,0 +1,206 @@
+"""
+    Benchmark variants of a function across input sizes on top of timing.measure, store the
+    results as JSON and check them against a stored baseline.
+"""
+from __future__ import annotations
+
+import datetime
+import functools
+import json
+import math
+import platform
+import statistics
+import sys
+from pathlib import Path
+from typing import Any, Callable, Sequence
+
+import numpy as np
+
+from .timing import _format_seconds, measure
+
+try:
+    from scipy import stats as _scipy_stats
+    _SCIPY_AVAILABLE = True
+except ImportError:
+    _scipy_stats = None
+    _SCIPY_AVAILABLE = False
+
+
+InputGenerator = Callable[[], Any]
+
+
+def sized_inputs(factory: Callable[[int], Any], sizes: Sequence[int]) -> list[tuple[int, InputGenerator]]:
+    """
+    Build (size, generator) pairs from a factory, e.g. sized_inputs(lambda n: np.random.rand(n, 3), [1e3, 1e4]).
+    The generator returns the positional arguments (a tuple) or the single argument.
+    """
+    return [(int(size), functools.partial(factory, int(size))) for size in sizes]
+
+
+def fit_scaling_exponent(sizes: Sequence[float], times: Sequence[float]) -> float | None:
+    """Least-squares slope of log(time) over log(size), e.g. about 1 for linear and 2 for quadratic cost."""
+    points = [(math.log(s), math.log(t)) for s, t in zip(sizes, times) if s > 0 and t > 0]
+    if len({x for x, _ in points}) < 2:
+        return None
+    x, y = np.array(points).T
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def _environment() -> dict[str, Any]:
+    env = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        numpy=np.__version__,
+        date=datetime.datetime.now().isoformat(timespec="seconds"),
+    )
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        env["torch"] = torch.__version__
+    return env
+
+
+def run_benchmark(
+    variants: dict[str, Callable],
+    inputs: Sequence[tuple[int, InputGenerator]],
+    *,
+    warmup: int = 1,
+    repeat: int = 7,
+    number: int | None = None,
+    min_time: float = 0.05,
+    output: str | Path | None = None,
+    verbose: bool = True,
+) -> dict[str, Any]:
+    """
+    Run every variant on every input with timing.measure.
+
+    Parameters
+    ----------
+    variants:
+        Name -> callable, e.g. {"imshow": imshow, "imshow_new": imshow_new}.
+    inputs:
+        (size, generator) pairs, see `sized_inputs`. The generator is called once per size and
+        the same input is given to all variants.
+    number:
+        Calls per measurement, None picks it so that one measurement takes `min_time`.
+    output:
+        If given, the results are also saved there as JSON.
+
+    Returns
+    -------
+    dict
+        {"environment": {...}, "variants": {name: {"scaling_exponent": float | None,
+        "runs": [TimingStats.to_dict() + size]}}}
+    """
+    results: dict[str, Any] = dict(environment=_environment(), variants={})
+    for name in variants:
+        results["variants"][name] = dict(runs=[], scaling_exponent=None)
+
+    for size, generator in inputs:
+        args = generator()
+        if not isinstance(args, tuple):
+            args = (args,)
+        for name, func in variants.items():
+            stats = measure(func, *args, warmup=warmup, repeat=repeat, number=number, min_time=min_time)
+            stats.result = None
+            run = stats.to_dict()
+            run["name"] = name
+            run["size"] = size
+            results["variants"][name]["runs"].append(run)
+            if verbose:
+                print(f"{name} size={size}: median {_format_seconds(stats.median)} (+- {_format_seconds(stats.stddev)})")
+
+    for name, variant in results["variants"].items():
+        variant["scaling_exponent"] = fit_scaling_exponent(
+            [run["size"] for run in variant["runs"]], [run["median"] for run in variant["runs"]])
+        if verbose and variant["scaling_exponent"] is not None:
+            print(f"{name}: time ~ size^{variant['scaling_exponent']:.2f}")
+
+    if output is not None:
+        save_benchmark(results, output)
+    return results
+
+
+def save_benchmark(results: dict[str, Any], path: str | Path) -> Path:
+    path = Path(path).expanduser()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2))
+    return path
+
+
+def load_benchmark(path: str | Path) -> dict[str, Any]:
+    return json.loads(Path(path).expanduser().read_text())
+
+
+def _welch_p_value(a: Sequence[float], b: Sequence[float]) -> float:
+    """Two-sided p-value of Welch's t-test, normal approximation when scipy is not installed."""
+    if len(a) < 2 or len(b) < 2:
+        return 1.0 if statistics.median(a) == statistics.median(b) else 0.0
+    if _SCIPY_AVAILABLE:
+        p_value = _scipy_stats.ttest_ind(a, b, equal_var=False).pvalue
+        return 0.0 if math.isnan(p_value) else float(p_value)
+    standard_error = math.sqrt(statistics.variance(a) / len(a) + statistics.variance(b) / len(b))
+    if standard_error == 0:
+        return 1.0 if statistics.fmean(a) == statistics.fmean(b) else 0.0
+    t = (statistics.fmean(a) - statistics.fmean(b)) / standard_error
+    return math.erfc(abs(t) / math.sqrt(2))
+
+
+def compare_benchmarks(
+    baseline: dict[str, Any] | str | Path,
+    current: dict[str, Any] | str | Path,
+    *,
+    threshold: float = 0.05,
+    alpha: float = 0.01,
+    verbose: bool = True,
+) -> list[dict[str, Any]]:
+    """
+    Compare every (variant, size) present in both results.
+
+    A run is a regression when its median is more than `threshold` (relative) slower than the
+    baseline and the difference of the per-repeat times is significant at `alpha` (Welch's t-test).
+
+    Returns
+    -------
+    list of dict(name, size, baseline, current, ratio, p_value, regression)
+    """
+    if not isinstance(baseline, dict):
+        baseline = load_benchmark(baseline)
+    if not isinstance(current, dict):
+        current = load_benchmark(current)
+
+    rows = []
+    for name, variant in current["variants"].items():
+        baseline_runs = {run["size"]: run for run in baseline["variants"].get(name, {}).get("runs", [])}
+        for run in variant["runs"]:
+            base = baseline_runs.get(run["size"])
+            if base is None:
+                continue
+            ratio = run["median"] / base["median"] if base["median"] > 0 else math.inf
+            p_value = _welch_p_value(base["times"], run["times"])
+            rows.append(dict(
+                name=name, size=run["size"], baseline=base["median"], current=run["median"],
+                ratio=ratio, p_value=p_value, regression=ratio > 1 + threshold and p_value < alpha,
+            ))
+
+    if verbose:
+        print(f"{'variant':<30} {'size':>10} {'baseline':>11} {'current':>11} {'ratio':>7} {'p':>8}")
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['name']:<30} {row['size']:>10} {_format_seconds(row['baseline']):>11} "
+                  f"{_format_seconds(row['current']):>11} {row['ratio']:>7.3f} {row['p_value']:>8.2g}{flag}")
+    return rows
+
+
+def has_regression(rows: Sequence[dict[str, Any]]) -> bool:
+    return any(row["regression"] for row in rows)
+
+
+__all__ = [
+    "sized_inputs",
+    "fit_scaling_exponent",
+    "run_benchmark",
+    "save_benchmark",
+    "load_benchmark",
+    "compare_benchmarks",
+    "has_regression",
+]
@@ -0,0 +1,271 @@
+"""
+    Stream tensors / arrays into an animated GIF or a raw-frame .npy file.
+
+    Frames go through the same deal_axis / type_agnosis normalization as imshow and are
+    encoded one at a time on a background thread, so only the frame being encoded and
+    at most `queue_size` waiting frames are held in memory.
+"""
+from __future__ import annotations
+
+import io
+import queue
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+
+from .pyplot import deal_axis, rgb_to_uint8, tensor2numpy, type_agnosis
+
+_NPY_HEADER_SIZE = 128
+_STOP = object()
+
+
+class ExportError(RuntimeError):
+    """Raised when a frame sequence cannot be exported."""
+
+
+class _GifEncoder():
+    """Animated GIF written frame by frame, each frame carries its own color table."""
+    def __init__(self, path: Path, fps: float, loop: int = 0):
+        self.file = open(path, 'wb')
+        self.delay = max(int(round(100.0 / fps)), 1)  # in 1/100 s
+        self.loop = loop
+        self.size: tuple[int, int] | None = None
+
+    def write(self, frame: np.ndarray) -> None:
+        from PIL import Image
+
+        height, width = frame.shape[:2]
+        if self.size is None:
+            self.size = (width, height)
+            self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0x70, 0, 0))
+            self.file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+        elif self.size != (width, height):
+            raise ExportError(f"Frame size changed from {self.size} to {(width, height)}")
+
+        image = Image.fromarray(frame)
+        if image.mode == 'RGB':
+            image = image.quantize(256)
+        buffer = io.BytesIO()
+        image.save(buffer, format='GIF')
+        self.file.write(b'\x21\xf9\x04\x00' + struct.pack('<H', self.delay) + b'\x00\x00')
+        self.file.write(_gif_image_block(buffer.getvalue()))
+
+    def close(self) -> None:
+        if self.size is not None:
+            self.file.write(b'\x3b')
+        self.file.close()
+
+
+def _skip_sub_blocks(data: bytes, pos: int) -> int:
+    while data[pos] != 0:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _gif_image_block(data: bytes) -> bytes:
+    """
+        Extract the image block of a single frame GIF, moving its global color table into
+        a local color table so that it can be appended to an animated GIF.
+    """
+    packed = data[10]
+    pos = 13
+    color_table = b''
+    if packed & 0x80:
+        color_table_size = 3 << ((packed & 0x07) + 1)
+        color_table = data[pos:pos + color_table_size]
+        pos += color_table_size
+
+    while data[pos] == 0x21:  # skip extensions written by the encoder
+        pos = _skip_sub_blocks(data, pos + 2)
+    if data[pos] != 0x2c:
+        raise ExportError("Unexpected GIF layout returned by PIL.")
+
+    descriptor = bytearray(data[pos:pos + 10])
+    pos += 10
+    if not descriptor[9] & 0x80:
+        descriptor[9] = (descriptor[9] & 0x78) | 0x80 | (packed & 0x07)
+        descriptor += color_table
+    end = _skip_sub_blocks(data, pos + 1)
+    return bytes(descriptor) + data[pos:end]
+
+
+class _NpyEncoder():
+    """
+        Uint8 frames appended to a .npy file, the header is rewritten with the final frame
+        count on close. The result can be opened with np.load(path, mmap_mode='r').
+    """
+    def __init__(self, path: Path):
+        self.file = open(path, 'wb')
+        self.file.write(b'\x00' * _NPY_HEADER_SIZE)
+        self.frame_shape: tuple[int, ...] | None = None
+        self.num_frames = 0
+
+    def write(self, frame: np.ndarray) -> None:
+        if self.frame_shape is None:
+            self.frame_shape = frame.shape
+        elif self.frame_shape != frame.shape:
+            raise ExportError(f"Frame shape changed from {self.frame_shape} to {frame.shape}")
+        self.file.write(np.ascontiguousarray(frame).tobytes())
+        self.num_frames += 1
+
+    def close(self) -> None:
+        shape = (self.num_frames,) + (self.frame_shape or (0,))
+        header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (shape,)
+        header = header.ljust(_NPY_HEADER_SIZE - 11) + '\n'
+        self.file.seek(0)
+        self.file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1'))
+        self.file.close()
+
+
+class SequenceWriter():
+    """
+        Incrementally export a sequence of tensors / arrays to an animated GIF (.gif) or a
+        raw uint8 frame container (.npy).
+
+        Normalization of single-channel and feature frames:
+        - `vmin` and `vmax` given: fixed global bounds.
+        - normalize="running": bounds grow with the min / max of all frames seen so far.
+        - normalize="frame": every frame is scaled by its own min / max.
+        RGB frames follow show_rgb: uint8 is kept, float is taken as [0, 1] (or denormalized).
+
+        Example:
+        >>> with SequenceWriter("heatmap.gif", fps=10, vmin=0, vmax=1) as writer:
+        ...     for batch in loader:
+        ...         writer.write(model(batch))
+    """
+    def __init__(
+        self,
+        path: str | Path,
+        fps: float = 10.0,
+        *,
+        vmin: float | None = None,
+        vmax: float | None = None,
+        normalize: str = "running",
+        cmap: str | None = None,
+        denorm: bool = False,
+        queue_size: int = 1,
+        loop: int = 0,
+    ):
+        self.path = Path(path).expanduser()
+        if normalize not in ("running", "frame"):
+            raise ExportError(f"Unsupported normalize mode: {normalize}")
+        if self.path.suffix == ".gif":
+            self.encoder: Any = _GifEncoder(self.path, fps, loop)
+        elif self.path.suffix == ".npy":
+            self.encoder = _NpyEncoder(self.path)
+        else:
+            raise ExportError(f"Unsupported output suffix: {self.path.suffix!r}, use '.gif' or '.npy'.")
+
+        self.vmin = vmin
+        self.vmax = vmax
+        self.normalize = normalize
+        self.denorm = denorm
+        self.cmap = None
+        if cmap is not None:
+            import matplotlib
+            self.cmap = matplotlib.colormaps[cmap]
+        self.num_frames = 0
+
+        self._running_min = np.inf
+        self._running_max = -np.inf
+        self._error: BaseException | None = None
+        self._queue: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+        self._thread = threading.Thread(target=self._encode_loop, name="pyhelp-export", daemon=True)
+        self._thread.start()
+
+    def write(self, frame: Any) -> None:
+        """Queue one frame, blocks only while the encoder is `queue_size` frames behind."""
+        self._raise_if_failed()
+        # deal_axis copies, the producer may overwrite its buffer right after this call
+        self._queue.put(deal_axis(tensor2numpy(frame)))
+        self.num_frames += 1
+
+    def close(self) -> None:
+        """Flush the queued frames and finalize the file."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._raise_if_failed()
+
+    def __enter__(self) -> "SequenceWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise ExportError(f"Encoding failed for {self.path}") from self._error
+
+    def _encode_loop(self) -> None:
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is _STOP:
+                    break
+                self.encoder.write(self._to_uint8(frame))
+        except BaseException as e:
+            self._error = e
+            while self._queue.get() is not _STOP:  # keep draining so that write() never blocks
+                pass
+        finally:
+            self.encoder.close()
+
+    def _to_uint8(self, image: np.ndarray) -> np.ndarray:
+        image_type = type_agnosis(image)
+        if image_type == "rgb":
+            return rgb_to_uint8(image, self.denorm)
+        if image_type == "feature":
+            image = np.linalg.norm(image, axis=-1)
+
+        image = image.astype(np.float32, copy=False)
+        if self.normalize == "frame":
+            low, high = np.nanmin(image), np.nanmax(image)
+        else:
+            self._running_min = min(self._running_min, float(np.nanmin(image)))
+            self._running_max = max(self._running_max, float(np.nanmax(image)))
+            low, high = self._running_min, self._running_max
+        low = self.vmin if self.vmin is not None else low
+        high = self.vmax if self.vmax is not None else high
+        image = np.clip((image - low) / max(high - low, 1e-12), 0, 1)
+
+        if self.cmap is not None:
+            return (self.cmap(image)[..., :3] * 255).astype(np.uint8)
+        return (image * 255).astype(np.uint8)
+
+
+def export_sequence(frames: Iterable[Any], path: str | Path, fps: float = 10.0, **kwargs: Any) -> Path:
+    """
+    Export a stream (e.g. a generator) of tensors / arrays to a .gif or .npy file.
+
+    Parameters
+    ----------
+    frames:
+        Iterable of numpy.ndarray / torch.Tensor, consumed lazily.
+    path:
+        Output file, the suffix selects the format.
+    fps:
+        Frame rate of the animation.
+    kwargs:
+        Passed to SequenceWriter (vmin, vmax, normalize, cmap, denorm, queue_size, loop).
+
+    Returns
+    -------
+    Path
+        The written path.
+    """
+    with SequenceWriter(path, fps, **kwargs) as writer:
+        for frame in frames:
+            writer.write(frame)
+    print(f"Exported {writer.num_frames} frames to {writer.path}")
+    return writer.path
+
+
+__all__ = [
+    "ExportError",
+    "SequenceWriter",
+    "export_sequence",
+]
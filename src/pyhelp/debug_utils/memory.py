@@ -0,0 +1,259 @@
+"""
+    Memory profiling helpers: peak RSS, tracemalloc allocation sites and numpy / torch
+    allocations left alive by a call.
+"""
+from __future__ import annotations
+
+import contextlib
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+import numpy as np
+
+try:
+    import psutil
+    _PSUTIL_AVAILABLE = True
+except ImportError:
+    psutil = None
+    _PSUTIL_AVAILABLE = False
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+
+def current_rss() -> int | None:
+    """Resident set size of this process in bytes, None if it can not be read."""
+    if _PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss() -> int | None:
+    """Peak resident set size of this process so far in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _format_bytes(num_bytes: float | None) -> str:
+    if num_bytes is None:
+        return "n/a"
+    for unit in ("B", "KiB", "MiB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}GiB"
+
+
+def _cpu_tensors() -> dict[int, Any]:
+    """Alive torch CPU tensors by id, only if torch is already imported."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return {}
+    tensors = {}
+    with warnings.catch_warnings():  # isinstance on some objects reads torch's deprecated attributes
+        warnings.simplefilter("ignore")
+        for obj in gc.get_objects():
+            try:
+                if isinstance(obj, torch.Tensor) and obj.device.type == "cpu":
+                    tensors[id(obj)] = obj
+            except Exception:
+                continue
+    return tensors
+
+
+def _tensor_storage_bytes(tensors: list[Any]) -> int:
+    storages = {}
+    for tensor in tensors:
+        try:
+            storage = tensor.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+        except Exception:
+            continue
+    return sum(storages.values())
+
+
+@dataclass
+class MemoryProfile:
+    """Memory usage of one profiled call or block, sizes in bytes."""
+    rss_before: int | None = None
+    rss_after: int | None = None
+    rss_peak: int | None = None
+    traced_peak: int = 0
+    top_allocations: list[dict[str, Any]] = field(default_factory=list)
+    numpy_alive_count: int = 0
+    numpy_alive_bytes: int = 0
+    torch_alive_count: int = 0
+    torch_alive_bytes: int = 0
+    timeline: list[tuple[float, int]] = field(default_factory=list)
+    duration: float = 0.0
+    result: Any = field(default=None, repr=False)
+
+    @property
+    def peak_rss_delta(self) -> int | None:
+        if self.rss_peak is None or self.rss_before is None:
+            return None
+        return self.rss_peak - self.rss_before
+
+    @property
+    def rss_delta(self) -> int | None:
+        if self.rss_after is None or self.rss_before is None:
+            return None
+        return self.rss_after - self.rss_before
+
+    def __str__(self) -> str:
+        lines = [
+            f"duration {self.duration:.3f}s, peak RSS delta {_format_bytes(self.peak_rss_delta)}, "
+            f"RSS delta {_format_bytes(self.rss_delta)}, traced peak {_format_bytes(self.traced_peak)}",
+            f"alive after call: {self.numpy_alive_count} numpy buffers ({_format_bytes(self.numpy_alive_bytes)}), "
+            f"{self.torch_alive_count} torch CPU tensors ({_format_bytes(self.torch_alive_bytes)})",
+        ]
+        if self.top_allocations:
+            lines.append("top allocation sites (still alive):")
+            for allocation in self.top_allocations:
+                lines.append(f"  {_format_bytes(allocation['size']):>10} in {allocation['count']:>6} blocks  {allocation['location']}")
+        return "\n".join(lines)
+
+
+class _RssSampler():
+    def __init__(self, interval: float, profile: MemoryProfile):
+        self.interval = interval
+        self.profile = profile
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="pyhelp-rss-sampler", daemon=True)
+        self.start_time = time.perf_counter()
+
+    def _run(self) -> None:
+        while True:
+            rss = current_rss()
+            if rss is not None:
+                self.profile.timeline.append((time.perf_counter() - self.start_time, rss))
+            if self.stop_event.wait(self.interval):
+                return
+
+
+@contextlib.contextmanager
+def memory_profile(top: int = 10, sample_interval: float | None = None, track_tensors: bool = True,
+                   trace_frames: int = 1) -> Iterator[MemoryProfile]:
+    """
+    Profile the memory of a block, the yielded MemoryProfile is filled on exit.
+
+    Parameters
+    ----------
+    top:
+        Number of tracemalloc allocation sites reported, by net size still alive.
+    sample_interval:
+        If given, RSS is sampled every `sample_interval` seconds into `timeline`, which also
+        catches peaks that ru_maxrss can not attribute to the block.
+    track_tensors:
+        Count torch CPU tensors created in the block and still alive (scans gc objects twice).
+    trace_frames:
+        Traceback depth for tracemalloc if it is started here.
+
+    Example:
+    >>> with memory_profile(sample_interval=0.01) as mem:
+    ...     image = deal_axis(big_array)
+    >>> print(mem)
+    """
+    profile = MemoryProfile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(trace_frames)
+    tensors_before = _cpu_tensors() if track_tensors else {}
+    gc.collect()
+    snapshot_before = tracemalloc.take_snapshot()
+    if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9, before the peak counts from the start of tracing
+        tracemalloc.reset_peak()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    max_rss_before = max_rss()
+    profile.rss_before = current_rss()
+
+    sampler = None
+    if sample_interval is not None:
+        sampler = _RssSampler(sample_interval, profile)
+        sampler.thread.start()
+
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.duration = time.perf_counter() - start
+        if sampler is not None:
+            sampler.stop_event.set()
+            sampler.thread.join()
+        profile.rss_after = current_rss()
+        profile.traced_peak = tracemalloc.get_traced_memory()[1] - traced_before
+
+        peaks = [rss for _, rss in profile.timeline]
+        max_rss_after = max_rss()
+        if max_rss_before is not None and max_rss_after is not None and max_rss_after > max_rss_before:
+            peaks.append(max_rss_after)  # a new process-wide peak was reached inside the block
+        if profile.rss_after is not None:
+            peaks.append(profile.rss_after)
+        if profile.rss_before is not None:
+            peaks.append(profile.rss_before)
+        profile.rss_peak = max(peaks) if peaks else None
+
+        snapshot_after = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        _fill_allocations(profile, snapshot_before, snapshot_after, top)
+        if track_tensors:
+            new_tensors = [tensor for key, tensor in _cpu_tensors().items() if key not in tensors_before]
+            profile.torch_alive_count = len(new_tensors)
+            profile.torch_alive_bytes = _tensor_storage_bytes(new_tensors)
+
+
+def _fill_allocations(profile: MemoryProfile, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int) -> None:
+    ignore = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, threading.__file__),
+        tracemalloc.Filter(False, __file__),
+    ]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    stats = [stat for stat in stats if stat.size_diff > 0]
+    stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+    profile.top_allocations = [
+        dict(location=f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+             size=stat.size_diff, count=stat.count_diff)
+        for stat in stats[:top]
+    ]
+
+    numpy_domain = [tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)]
+    numpy_stats = after.filter_traces(numpy_domain).compare_to(before.filter_traces(numpy_domain), "filename")
+    profile.numpy_alive_bytes = max(sum(stat.size_diff for stat in numpy_stats), 0)
+    profile.numpy_alive_count = max(sum(stat.count_diff for stat in numpy_stats), 0)
+
+
+def memprof(func, *args, top=10, sample_interval=None, track_tensors=True, **kwargs) -> MemoryProfile:
+    """
+    Profile the memory of `func(*args, **kwargs)`, print the summary and return the
+    MemoryProfile, the result of func is in `.result`.
+    """
+    with memory_profile(top=top, sample_interval=sample_interval, track_tensors=track_tensors) as profile:
+        profile.result = func(*args, **kwargs)
+    print(f"{getattr(func, '__name__', type(func).__name__)} memory: {profile}")
+    return profile
+
+
+__all__ = [
+    "MemoryProfile",
+    "current_rss",
+    "max_rss",
+    "memory_profile",
+    "memprof",
+]
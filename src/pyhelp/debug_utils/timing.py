@@ -1,26 +1,1092 @@
-import torch
-def profiler(func, *args, **kwargs):
-    with torch.autograd.profiler.profile(use_cuda=True, record_shapes=True, with_stack=True) as prof:
+"""
+    Timing and profiling helpers for debugging, on CPU or CUDA.
+"""
+from __future__ import annotations
+
+import array
+import collections
+import functools
+import json
+import math
+import os
+import statistics
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Any, Callable, Iterable, Iterator
+
+try:
+    import torch
+    _TORCH_AVAILABLE = True
+except ImportError:
+    torch = None  # type: ignore[assignment]
+    _TORCH_AVAILABLE = False
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if abs(seconds) >= scale:
+            return f"{seconds / scale:.3f}{unit}"
+    return f"{seconds / 1e-9:.1f}ns"
+
+
+def _func_name(func: Callable) -> str:
+    return getattr(func, "__name__", type(func).__name__)
+
+
+def _uses_cuda(*objects: Any) -> bool:
+    """Whether any (nested) argument is a CUDA tensor or a module with CUDA parameters."""
+    for obj in objects:
+        if isinstance(obj, torch.Tensor):
+            if obj.is_cuda:
+                return True
+        elif isinstance(obj, torch.nn.Module):
+            parameter = next(obj.parameters(), None)
+            if parameter is not None and parameter.is_cuda:
+                return True
+        elif isinstance(obj, (list, tuple)):
+            if _uses_cuda(*obj):
+                return True
+        elif isinstance(obj, dict):
+            if _uses_cuda(*obj.values()):
+                return True
+    return False
+
+
+def resolve_device(func: Callable, args: tuple, kwargs: dict, device: str = "auto") -> str:
+    """
+    Decide which clock to use: "cuda" when CUDA is available and the function, a bound
+    module or the arguments live on GPU, "cpu" otherwise.
+    """
+    if device != "auto":
+        return device
+    if not _TORCH_AVAILABLE or not torch.cuda.is_available():
+        return "cpu"
+    if _uses_cuda(func, getattr(func, "__self__", None), args, kwargs):
+        return "cuda"
+    return "cpu"
+
+
+class _CpuClock():
+    def start(self) -> None:
+        self.begin = time.perf_counter_ns()
+
+    def stop(self) -> float:
+        return (time.perf_counter_ns() - self.begin) * 1e-9
+
+
+class _CudaClock():
+    def __init__(self) -> None:
+        self.begin = torch.cuda.Event(enable_timing=True)
+        self.end = torch.cuda.Event(enable_timing=True)
+
+    def start(self) -> None:
+        torch.cuda.synchronize()
+        self.begin.record()
+
+    def stop(self) -> float:
+        self.end.record()
+        torch.cuda.synchronize()
+        return self.begin.elapsed_time(self.end) * 1e-3
+
+
+@dataclass
+class TimingStats:
+    """Per-call timings (seconds) of `repeat` measurements, each averaged over `number` calls."""
+    name: str
+    times: list[float]
+    number: int = 1
+    device: str = "cpu"
+    result: Any = field(default=None, repr=False)
+
+    @property
+    def repeat(self) -> int:
+        return len(self.times)
+
+    @property
+    def min(self) -> float:
+        return min(self.times)
+
+    @property
+    def max(self) -> float:
+        return max(self.times)
+
+    @property
+    def mean(self) -> float:
+        return statistics.fmean(self.times)
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.times)
+
+    @property
+    def stddev(self) -> float:
+        return statistics.stdev(self.times) if len(self.times) > 1 else 0.0
+
+    @property
+    def p95(self) -> float:
+        return self.percentile(95)
+
+    @property
+    def ops_per_sec(self) -> float:
+        return 1.0 / self.mean if self.mean > 0 else math.inf
+
+    def percentile(self, q: float) -> float:
+        """Linearly interpolated percentile, q in [0, 100]."""
+        ordered = sorted(self.times)
+        position = (len(ordered) - 1) * q / 100.0
+        low = int(math.floor(position))
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    def to_dict(self) -> dict[str, Any]:
+        return dict(
+            name=self.name, device=self.device, number=self.number, repeat=self.repeat,
+            min=self.min, median=self.median, mean=self.mean, p95=self.p95,
+            stddev=self.stddev, ops_per_sec=self.ops_per_sec, times=list(self.times),
+        )
+
+    def __str__(self) -> str:
+        if self.repeat == 1 and self.number == 1:
+            return f"{self.name} time: {self.times[0] * 1e3}ms"
+        return (
+            f"{self.name} [{self.device}] {self.repeat} x {self.number} calls: "
+            f"min {_format_seconds(self.min)}, median {_format_seconds(self.median)}, "
+            f"mean {_format_seconds(self.mean)} +- {_format_seconds(self.stddev)}, "
+            f"p95 {_format_seconds(self.p95)}, {self.ops_per_sec:.1f} ops/s"
+        )
+
+
+def _autorange(func: Callable, args: tuple, kwargs: dict, clock: Any, min_time: float) -> tuple[int, Any]:
+    """Find a loop count whose total time is at least min_time, as timeit.Timer.autorange."""
+    result = None
+    i = 1
+    while True:
+        for number in (i, 2 * i, 5 * i):
+            clock.start()
+            for _ in range(number):
+                result = func(*args, **kwargs)
+            if clock.stop() >= min_time:
+                return number, result
+        i *= 10
+
+
+def measure(func, *args, warmup=0, repeat=1, number=1, min_time=0.2, device="auto", histogram=None,
+            **kwargs) -> TimingStats:
+    """
+    Time `func(*args, **kwargs)` and return a TimingStats holding the last result.
+
+    The options below are keywords of measure and are not passed to func, wrap func with
+    functools.partial to give it keywords of the same names.
+
+    Parameters
+    ----------
+    warmup:
+        Untimed calls before measuring.
+    repeat:
+        Number of measurements.
+    number:
+        Calls per measurement; None (or 0) picks it automatically so that one measurement
+        takes at least `min_time` seconds, like timeit.
+    device:
+        "auto" uses CUDA events when the inputs live on GPU and time.perf_counter_ns otherwise;
+        "cpu" / "cuda" force the clock.
+    histogram:
+        A Histogram (or the name of one in `metrics`) fed with the per-call time of every measurement.
+    """
+    return _measure(func, args, kwargs, warmup=warmup, repeat=repeat, number=number, min_time=min_time,
+                    device=device, histogram=histogram)
+
+
+def _measure(func: Callable, args: tuple, kwargs: dict, warmup: int = 0, repeat: int = 1, number: int | None = 1,
+             min_time: float = 0.2, device: str = "auto", histogram: Any = None) -> TimingStats:
+    device = resolve_device(func, args, kwargs, device)
+    clock = _CudaClock() if device.startswith("cuda") else _CpuClock()
+
+    result = None
+    for _ in range(warmup):
         result = func(*args, **kwargs)
-    print(prof.key_averages().table(sort_by="self_cuda_time_total"))
-    return dict(result=result, prof=prof)
+    if not number:
+        number, result = _autorange(func, args, kwargs, clock, min_time)
+
+    times = []
+    for _ in range(max(repeat, 1)):
+        clock.start()
+        for _ in range(number):
+            result = func(*args, **kwargs)
+        times.append(clock.stop() / number)
+    if histogram is not None:
+        if isinstance(histogram, str):
+            histogram = metrics.histogram(histogram)
+        for seconds in times:
+            histogram.record(seconds)
+    return TimingStats(name=_func_name(func), times=times, number=number, device=device, result=result)
+
 
 def timer(func, *args, **kwargs):
-    torch.cuda.synchronize()
-    start = torch.cuda.Event(enable_timing=True)
-    end = torch.cuda.Event(enable_timing=True)
-    start.record()
-    result = func(*args, **kwargs)
-    end.record()
+    """
+    Print the time spent in one call of `func(*args, **kwargs)` and return its result.
+    All keyword arguments are passed to func, see `measure` for repeated calls and statistics.
+    """
+    stats = _measure(func, args, kwargs)
+    print(stats)
+    return stats.result
+
+
+class _ScopeNode():
+    __slots__ = ("name", "count", "total_ns", "children")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.total_ns = 0
+        self.children: dict[str, _ScopeNode] = {}
+
+
+class _ThreadScopes():
+    """Scope tree and optional trace events recorded by one thread, only touched by that thread."""
+    def __init__(self) -> None:
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.root = _ScopeNode("<root>")
+        self.stack = [self.root]
+        self.events: list[tuple[str, int, int]] = []
+
+
+_scopes_enabled = False
+_scopes_trace = False
+_scopes_max_events = 0
+_scopes_local = threading.local()
+_scopes_threads: list[_ThreadScopes] = []  # appended once per thread, read at report time
+
+
+def _current_thread_scopes() -> _ThreadScopes:
+    state = getattr(_scopes_local, "state", None)
+    if state is None:
+        state = _scopes_local.state = _ThreadScopes()
+        _scopes_threads.append(state)
+    return state
+
+
+class scope():
+    """
+    Nestable timing scope, usable as a context manager or a decorator.
+
+    Scopes record a per-thread tree with call counts and total / self time; the threads are
+    merged when reporting. Nothing is recorded (and the cost is a few hundred nanoseconds)
+    unless `enable_scopes()` was called. Each process (e.g. a DataLoader worker) has its own
+    scopes, export them per process with `export_scopes_json`.
+
+    Example:
+    >>> enable_scopes()
+    >>> with scope("train_step"):
+    ...     with scope("forward"):
+    ...         loss = model(batch)
+    >>> @scope("logging")
+    ... def log(loss): ...
+    >>> scope_report()
+    """
+    __slots__ = ("name", "_state", "_node", "_start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "scope":
+        if not _scopes_enabled:
+            self._state = None
+            return self
+        state = _current_thread_scopes()
+        parent = state.stack[-1]
+        node = parent.children.get(self.name)
+        if node is None:
+            node = parent.children[self.name] = _ScopeNode(self.name)
+        state.stack.append(node)
+        self._state = state
+        self._node = node
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        state = self._state
+        if state is None:
+            return
+        elapsed = time.perf_counter_ns() - self._start
+        node = self._node
+        node.count += 1
+        node.total_ns += elapsed
+        if state.stack[-1] is node:
+            state.stack.pop()
+        if _scopes_trace and len(state.events) < _scopes_max_events:
+            state.events.append((self.name, self._start, elapsed))
+
+    def __call__(self, func: Callable) -> Callable:
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with scope(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def enable_scopes(trace: bool = False, max_events: int = 1000000) -> None:
+    """Start recording scopes. With trace=True, individual events are kept (per thread up to max_events) for the Chrome trace."""
+    global _scopes_enabled, _scopes_trace, _scopes_max_events
+    _scopes_trace = trace
+    _scopes_max_events = max_events
+    _scopes_enabled = True
+
+
+def disable_scopes() -> None:
+    global _scopes_enabled
+    _scopes_enabled = False
+
+
+def reset_scopes() -> None:
+    """Drop everything recorded so far, in all threads."""
+    for state in list(_scopes_threads):
+        state.root.children = {}
+        state.stack[:] = [state.root]
+        state.events = []
+
+
+def _merge_scope_node(target: dict[str, Any], node: _ScopeNode) -> None:
+    target["count"] += node.count
+    target["total_ns"] += node.total_ns
+    for child in list(node.children.values()):
+        merged = target["children"].setdefault(child.name, dict(count=0, total_ns=0, children={}))
+        _merge_scope_node(merged, child)
+
+
+def _finalize_scope_node(name: str, node: dict[str, Any]) -> dict[str, Any]:
+    children = [_finalize_scope_node(child_name, child) for child_name, child in node["children"].items()]
+    children.sort(key=lambda child: child["total_s"], reverse=True)
+    total_s = node["total_ns"] * 1e-9
+    return dict(
+        name=name,
+        count=node["count"],
+        total_s=total_s,
+        self_s=max(total_s - sum(child["total_s"] for child in children), 0.0),
+        children=children,
+    )
+
+
+def scope_tree() -> list[dict[str, Any]]:
+    """
+    Merge the scopes of all threads by path. Returns the top level scopes sorted by total time,
+    each as dict(name, count, total_s, self_s, children).
+    """
+    merged: dict[str, Any] = dict(count=0, total_ns=0, children={})
+    for state in list(_scopes_threads):
+        _merge_scope_node(merged, state.root)
+    return _finalize_scope_node("<root>", merged)["children"]
+
+
+def scope_report(file: Any = None) -> None:
+    """Print the merged scope tree sorted by total time."""
+    tree = scope_tree()
+    grand_total = sum(node["total_s"] for node in tree) or 1.0
+    file = sys.stdout if file is None else file
+    print(f"{'scope':<40} {'calls':>9} {'total':>11} {'self':>11} {'%total':>7}", file=file)
+
+    def visit(node: dict[str, Any], depth: int) -> None:
+        label = "  " * depth + node["name"]
+        print(f"{label:<40} {node['count']:>9} {_format_seconds(node['total_s']):>11} "
+              f"{_format_seconds(node['self_s']):>11} {100.0 * node['total_s'] / grand_total:>6.1f}%", file=file)
+        for child in node["children"]:
+            visit(child, depth + 1)
+
+    for node in tree:
+        visit(node, 0)
+
+
+def export_scopes_json(path: str | Path) -> Path:
+    """Write the merged scope tree as JSON."""
+    path = Path(path).expanduser()
+    path.write_text(json.dumps(dict(pid=os.getpid(), scopes=scope_tree()), indent=2))
+    return path
+
+
+def export_scopes_chrome_trace(path: str | Path) -> Path:
+    """Write the events recorded with enable_scopes(trace=True) in Chrome trace format (chrome://tracing, Perfetto)."""
+    pid = os.getpid()
+    events: list[dict[str, Any]] = []
+    for state in list(_scopes_threads):
+        events.append(dict(name="thread_name", ph="M", pid=pid, tid=state.thread_id, args=dict(name=state.thread_name)))
+        for name, start_ns, duration_ns in list(state.events):
+            events.append(dict(name=name, ph="X", pid=pid, tid=state.thread_id,
+                               ts=start_ns / 1e3, dur=duration_ns / 1e3))
+    path = Path(path).expanduser()
+    path.write_text(json.dumps(dict(traceEvents=events, displayTimeUnit="ms")))
+    return path
+
+
+
+@dataclass
+class OpStats:
+    """Aggregate of one operator (and input shapes) in a torch profile, times in microseconds."""
+    name: str
+    input_shapes: str
+    calls: int
+    self_cpu_us: float
+    cpu_total_us: float
+    self_cuda_us: float = 0.0
+    cuda_total_us: float = 0.0
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (self.name, self.input_shapes)
+
+
+def _event_time(event: Any, *names: str) -> float:
+    """Read the first available attribute, torch renamed cuda_* to device_* in recent versions."""
+    for name in names:
+        value = getattr(event, name, None)
+        if value is not None:
+            return float(value)
+    return 0.0
+
+
+def profile_ops(prof: Any) -> list[OpStats]:
+    """Per-operator aggregates of a finished torch profiler, grouped by input shapes."""
+    ops = []
+    for event in prof.key_averages(group_by_input_shape=True):
+        ops.append(OpStats(
+            name=event.key,
+            input_shapes=str(event.input_shapes),
+            calls=int(event.count),
+            self_cpu_us=_event_time(event, "self_cpu_time_total"),
+            cpu_total_us=_event_time(event, "cpu_time_total"),
+            self_cuda_us=_event_time(event, "self_device_time_total", "self_cuda_time_total"),
+            cuda_total_us=_event_time(event, "device_time_total", "cuda_time_total"),
+        ))
+    return ops
+
+
+def diff_profiles(before: Iterable[OpStats], after: Iterable[OpStats], metric: str = "self_cpu_us") -> list[dict[str, Any]]:
+    """
+    Compare two lists of OpStats by (name, input_shapes) on `metric`.
+    Returns dict(name, input_shapes, before, after, delta) sorted by the largest absolute change.
+    """
+    before_map = {op.key: op for op in before}
+    after_map = {op.key: op for op in after}
+    rows: list[dict[str, Any]] = []
+    for key in set(before_map) | set(after_map):
+        old = getattr(before_map[key], metric) if key in before_map else 0.0
+        new = getattr(after_map[key], metric) if key in after_map else 0.0
+        rows.append(dict(name=key[0], input_shapes=key[1], before=old, after=new, delta=new - old))
+    rows.sort(key=lambda row: abs(row["delta"]), reverse=True)
+    return rows
+
+
+def profiler(func, *args, **kwargs):
+    """
+    Profile one call of `func(*args, **kwargs)` with torch.profiler and print the operator table.
+    All keyword arguments are passed to func, see `profile` for warmup, steps and exports.
+    """
+    return profile(func, args, kwargs)
+
 
-    torch.cuda.synchronize()
-    print(f"{func.__name__} time: {start.elapsed_time(end)}ms")
-    return result
+def profile(func, args=(), kwargs=None, warmup=0, steps=1, trace_path=None, stacks_path=None,
+            sort_by=None, row_limit=30):
+    """
+    Profile `func(*args, **kwargs)` with torch.profiler and print the operator table.
+
+    CPU activity is always recorded, CUDA activity when CUDA is available. The function is
+    called `warmup` times unrecorded, then `steps` recorded times.
+
+    Parameters
+    ----------
+    trace_path:
+        If given, export a Chrome / Perfetto trace (.json).
+    stacks_path:
+        If given, export stack-collapsed samples for flamegraph.pl / speedscope.
+    sort_by:
+        Table sort key, by default self CUDA time when CUDA is used and self CPU time otherwise.
+
+    Returns
+    -------
+    dict
+        result: the last result of func; prof: the torch profiler;
+        ops: list of OpStats, comparable with `diff_profiles`.
+    """
+    kwargs = kwargs or {}
+    use_cuda = torch.cuda.is_available()
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if use_cuda:
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    schedule = None
+    if warmup > 0 or steps > 1:
+        schedule = torch.profiler.schedule(wait=0, warmup=warmup, active=steps, repeat=1)
+    experimental_config = None
+    if stacks_path is not None: # export_stacks writes an empty file without the verbose stacks
+        experimental_config = torch._C._profiler._ExperimentalConfig(verbose=True)
+
+    with torch.profiler.profile(activities=activities, schedule=schedule, record_shapes=True, with_stack=True,
+                                experimental_config=experimental_config) as prof:
+        for _ in range(warmup + steps):
+            result = func(*args, **kwargs)
+            if use_cuda:
+                torch.cuda.synchronize()
+            prof.step()
+
+    if sort_by is None:
+        sort_by = "self_cuda_time_total" if use_cuda else "self_cpu_time_total"
+    print(prof.key_averages().table(sort_by=sort_by, row_limit=row_limit))
+    if trace_path is not None:
+        prof.export_chrome_trace(str(trace_path))
+    if stacks_path is not None:
+        prof.export_stacks(str(stacks_path), "self_cuda_time_total" if use_cuda else "self_cpu_time_total")
+    return dict(result=result, prof=prof, ops=profile_ops(prof))
+
+
+def _code_label(code: Any) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler():
+    """
+    Statistical profiler for pure-Python hot paths.
+
+    A background thread snapshots `sys._current_frames()` every `interval` seconds and counts
+    the Python stacks of the profiled thread (the one calling start, or all threads), so the
+    profiled code runs without per-call instrumentation.
+
+    Example:
+    >>> with SamplingProfiler(interval=0.001) as sampler:
+    ...     convert_dataset()
+    >>> sampler.print_table(top=20)
+    >>> sampler.export_folded("stacks.folded") # flamegraph.pl / speedscope input
+    """
+    def __init__(self, interval: float = 0.001, all_threads: bool = False, max_depth: int = 256):
+        self.interval = interval
+        self.all_threads = all_threads
+        self.max_depth = max_depth
+        self.stacks: collections.Counter = collections.Counter() # tuple of code objects, root first -> samples
+        self.num_samples = 0
+        self.duration = 0.0
+        self._target: int | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> "SamplingProfiler":
+        self._target = None if self.all_threads else threading.get_ident()
+        self._stop.clear()
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_loop, name="pyhelp-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.duration += time.perf_counter() - self._start_time
+        return self
+
+    def __enter__(self) -> "SamplingProfiler":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def _sample_loop(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self._target is not None and thread_id != self._target):
+                    continue
+                stack: list[CodeType] = []
+                current: FrameType | None = frame
+                while current is not None and len(stack) < self.max_depth:
+                    stack.append(current.f_code)
+                    current = current.f_back
+                stack.reverse()
+                self.stacks[tuple(stack)] += 1
+                self.num_samples += 1
+
+    def folded(self) -> list[str]:
+        """Stack-collapsed lines 'root;...;leaf count' for flamegraph tools."""
+        lines: collections.Counter[str] = collections.Counter()
+        for stack, count in self.stacks.items():
+            lines[";".join(_code_label(code).replace(";", ":") for code in stack)] += count
+        return [f"{stack} {count}" for stack, count in lines.most_common()]
+
+    def export_folded(self, path: str | Path) -> Path:
+        path = Path(path).expanduser()
+        path.write_text("\n".join(self.folded()) + "\n")
+        return path
+
+    def top(self, n: int = 20, sort_by: str = "self") -> list[dict[str, Any]]:
+        """
+        Functions with the most samples, as dict(function, self, cumulative, self_s, cumulative_s).
+        sort_by is "self" (samples where the function is the leaf) or "cumulative" (samples where it is on the stack).
+        """
+        self_counts: collections.Counter = collections.Counter()
+        cumulative_counts: collections.Counter = collections.Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                self_counts[stack[-1]] += count
+            for code in set(stack):
+                cumulative_counts[code] += count
+        counts = self_counts if sort_by == "self" else cumulative_counts
+        seconds_per_sample = self.duration / self.num_samples if self.num_samples else self.interval
+        return [
+            dict(function=_code_label(code), self=self_counts[code], cumulative=cumulative_counts[code],
+                 self_s=self_counts[code] * seconds_per_sample,
+                 cumulative_s=cumulative_counts[code] * seconds_per_sample)
+            for code, _ in counts.most_common(n)
+        ]
+
+    def print_table(self, top: int = 20, sort_by: str = "self", file: Any = None) -> None:
+        total = self.num_samples or 1
+        file = sys.stdout if file is None else file
+        print(f"{self.num_samples} samples in {_format_seconds(self.duration)}", file=file)
+        print(f"{'self%':>7} {'cum%':>7} {'self':>11} {'cum':>11}  function", file=file)
+        for row in self.top(top, sort_by):
+            print(f"{100.0 * row['self'] / total:>6.1f}% {100.0 * row['cumulative'] / total:>6.1f}% "
+                  f"{_format_seconds(row['self_s']):>11} {_format_seconds(row['cumulative_s']):>11}  {row['function']}",
+                  file=file)
+
+
+def profile_sampling(func, *args, interval=0.001, top=20, sort_by="self", folded_path=None, **kwargs):
+    """
+    Profile `func(*args, **kwargs)` with the SamplingProfiler and print the top functions.
+
+    Returns
+    -------
+    dict
+        result: the result of func; prof: the SamplingProfiler.
+    """
+    with SamplingProfiler(interval=interval) as sampler:
+        result = func(*args, **kwargs)
+    sampler.print_table(top=top, sort_by=sort_by)
+    if folded_path is not None:
+        sampler.export_folded(folded_path)
+    return dict(result=result, prof=sampler)
+
+
+
+def _percentile(values: Any, q: float) -> float:
+    if not len(values):
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(round((len(ordered) - 1) * q / 100.0)), len(ordered) - 1)]
+
+
+class throughput():
+    """
+    Wrap an iterable (e.g. a DataLoader) to tell whether a loop is input bound.
+
+    For each step the time waiting in `__next__` and the time spent in the loop body are
+    recorded (two perf_counter calls and two appends per step). A rolling summary is printed
+    every `report_every` steps, waits longer than `stall_threshold` seconds are flagged, and
+    `summary()` returns the totals and latency percentiles once the loop is over.
+
+    Example:
+    >>> meter = throughput(loader, report_every=100, stall_threshold=1.0, item_count=len)
+    >>> for batch in meter:
+    ...     train_step(batch)
+    >>> meter.summary()["wait_fraction"]
+    """
+    def __init__(self, iterable: Iterable, report_every: int | None = 100, stall_threshold: float | None = 1.0,
+                 item_count: Callable[[Any], int] | None = None, name: str = "throughput",
+                 verbose: bool = True, file: Any = None):
+        """
+        report_every: steps between rolling summaries, None to disable them.
+        stall_threshold: seconds in __next__ reported as a stall, None to disable.
+        item_count: maps a batch to its number of items (e.g. len), otherwise one item per step.
+        """
+        self.iterable = iterable
+        self.report_every = report_every
+        self.stall_threshold = stall_threshold
+        self.item_count = item_count
+        self.name = name
+        self.verbose = verbose
+        self.file = file
+        self.wait_times = array.array("d")
+        self.body_times = array.array("d")
+        self.num_items = 0
+        self.stalls: list[tuple[int, float]] = []
+        self.elapsed = 0.0
+
+    def __len__(self) -> int:
+        return len(self.iterable)  # type: ignore
+
+    def __iter__(self) -> Iterator:
+        clock = time.perf_counter
+        wait_times, body_times = self.wait_times, self.body_times
+        iterator = iter(self.iterable)
+        start = last_yield = clock()
+        step = len(wait_times)  # steps numbered across iterations (epochs)
+        first = True  # no body before the first item of this iteration
+        try:
+            while True:
+                before_next = clock()
+                if not first:
+                    body_times.append(before_next - last_yield)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                first = False
+                last_yield = clock()
+                wait = last_yield - before_next
+                wait_times.append(wait)
+                step += 1
+                if self.item_count is not None:
+                    self.num_items += self.item_count(item)
+                if self.stall_threshold is not None and wait > self.stall_threshold:
+                    self.stalls.append((step, wait))
+                    self._print(f"[{self.name}] stall at step {step}: waited {_format_seconds(wait)} for the next item")
+                if self.report_every and step % self.report_every == 0:
+                    self._report(step)
+                    last_yield = clock()
+                yield item
+        finally:
+            if len(body_times) < len(wait_times):  # the loop was left early
+                body_times.append(clock() - last_yield)
+            self.elapsed += clock() - start
+            if self.verbose:
+                self.print_summary()
+
+    def _print(self, message: str) -> None:
+        if self.verbose:
+            print(message, file=self.file if self.file is not None else sys.stdout)
+
+    def _report(self, step: int) -> None:
+        window = self.report_every or step
+        waits = self.wait_times[-window:]
+        bodies = self.body_times[-(window - 1):] if window > 1 else array.array("d")
+        wait_total, body_total = sum(waits), sum(bodies)
+        total = wait_total + body_total
+        steps_per_sec = len(waits) / total if total > 0 else math.inf
+        self._print(
+            f"[{self.name}] step {step}: {steps_per_sec:.1f} steps/s, "
+            f"waiting {100.0 * wait_total / total if total > 0 else 0.0:.1f}%, "
+            f"wait p50 {_format_seconds(_percentile(waits, 50))} p95 {_format_seconds(_percentile(waits, 95))}"
+        )
+
+    def summary(self) -> dict[str, Any]:
+        """Totals, rates and latency percentiles of all steps so far."""
+        steps = len(self.wait_times)
+        wait_total, body_total = sum(self.wait_times), sum(self.body_times)
+        latencies = [wait + body for wait, body in zip(self.wait_times, self.body_times)]
+        items = self.num_items if self.item_count is not None else steps
+        busy = wait_total + body_total
+        return dict(
+            steps=steps,
+            items=items,
+            elapsed_s=self.elapsed,
+            steps_per_sec=steps / self.elapsed if self.elapsed > 0 else 0.0,
+            items_per_sec=items / self.elapsed if self.elapsed > 0 else 0.0,
+            wait_s=wait_total,
+            body_s=body_total,
+            wait_fraction=wait_total / busy if busy > 0 else 0.0,
+            wait_p50_s=_percentile(self.wait_times, 50),
+            wait_p95_s=_percentile(self.wait_times, 95),
+            wait_max_s=max(self.wait_times) if steps else 0.0,
+            step_p50_s=_percentile(latencies, 50),
+            step_p95_s=_percentile(latencies, 95),
+            step_p99_s=_percentile(latencies, 99),
+            stalls=list(self.stalls),
+        )
+
+    def print_summary(self) -> None:
+        summary = self.summary()
+        verdict = "input bound" if summary["wait_fraction"] > 0.5 else "compute bound"
+        self._print(
+            f"[{self.name}] {summary['steps']} steps, {summary['items_per_sec']:.1f} items/s, "
+            f"waiting {100.0 * summary['wait_fraction']:.1f}% ({verdict}), "
+            f"step p50 {_format_seconds(summary['step_p50_s'])} p95 {_format_seconds(summary['step_p95_s'])} "
+            f"p99 {_format_seconds(summary['step_p99_s'])}, {len(summary['stalls'])} stalls"
+        )
+
+
+
+class _ThreadSharded():
+    """Per-thread shards of a metric, each thread only writes its own shard, readers sum them."""
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self._local = threading.local()
+        self._shards: list[list[float]] = []
+
+    def _new_shard(self) -> list[float]:
+        shard = self._empty_shard()
+        self._local.shard = shard
+        self._shards.append(shard)
+        return shard
+
+    def _empty_shard(self) -> list[float]:
+        return [0.0]
+
+    def _merged(self) -> list[float]:
+        merged = self._empty_shard()
+        for shard in list(self._shards):
+            for i, value in enumerate(list(shard)):
+                merged[i] += value
+        return merged
+
+
+class Counter(_ThreadSharded):
+    """Monotonic counter."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[0] += amount
+
+    @property
+    def value(self) -> float:
+        return self._merged()[0]
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Gauge():
+    """Last set value, inc / dec are serialized with a lock."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str = ""):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Histogram(_ThreadSharded):
+    """
+    Log-bucketed histogram with fixed memory and O(1) record.
+    Every power of two between `min_value` and `max_value` is split into `sub_buckets` buckets
+    (relative bucket width below 1 / sub_buckets), plus one underflow and one overflow bucket.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", min_value: float = 1e-6, max_value: float = 1e3, sub_buckets: int = 4):
+        super().__init__(name, help)
+        self.sub_buckets = sub_buckets
+        self._min_exp = math.frexp(min_value)[1]
+        self._max_exp = math.frexp(max_value)[1]
+        self.num_buckets = (self._max_exp - self._min_exp + 1) * sub_buckets + 2
+
+    def _empty_shard(self) -> list[float]:
+        return [0.0] * (self.num_buckets + 2)  # bucket counts, sum, count
+
+    def record(self, value: float) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            index = (exponent - self._min_exp) * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets) + 1
+            index = min(max(index, 0), self.num_buckets - 1)
+        else:
+            index = 0
+        shard[index] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def time(self) -> "_HistogramTimer":
+        """Context manager recording the elapsed seconds of the block."""
+        return _HistogramTimer(self)
+
+    def upper_bound(self, index: int) -> float:
+        if index >= self.num_buckets - 1:
+            return math.inf
+        if index == 0:
+            return math.ldexp(0.5, self._min_exp)
+        exponent = (index - 1) // self.sub_buckets + self._min_exp
+        sub = (index - 1) % self.sub_buckets
+        return math.ldexp(0.5 + (sub + 1) / (2 * self.sub_buckets), exponent)
+
+    def snapshot(self) -> dict[str, Any]:
+        merged = self._merged()
+        counts, total, count = merged[:-2], merged[-2], int(merged[-1])
+
+        def quantile(q: float) -> float:
+            if count == 0:
+                return 0.0
+            rank, seen = q * count, 0.0
+            for index, bucket_count in enumerate(counts):
+                seen += bucket_count
+                if seen >= rank and bucket_count:
+                    return self.upper_bound(index)
+            return math.inf
+
+        return dict(count=count, sum=total, mean=total / count if count else 0.0,
+                    p50=quantile(0.5), p90=quantile(0.9), p99=quantile(0.99),
+                    buckets=[(self.upper_bound(i), c) for i, c in enumerate(counts) if c])
+
+
+class _HistogramTimer():
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self) -> "_HistogramTimer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+def _prometheus_name(name: str) -> str:
+    name = "".join(c if c.isalnum() or c in "_:" else "_" for c in name)
+    return name if name and not name[0].isdigit() else "_" + name
+
+
+def _prometheus_value(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(float(value))
+
+
+class MetricsRegistry():
+    """
+    Named counters, gauges and histograms, get-or-create by name.
+
+    Example:
+    >>> requests = metrics.counter("requests", "handled requests")
+    >>> latency = metrics.histogram("latency_seconds")
+    >>> with latency.time():
+    ...     handle(request)
+    >>> requests.inc()
+    >>> metrics.start_exporter("metrics.prom", interval=10)
+    """
+    def __init__(self) -> None:
+        self._metrics: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._exporters: list[_MetricsExporter] = []
+
+    def _get_or_create(self, cls: type[Counter] | type[Gauge] | type[Histogram], name: str, *args: Any, **kwargs: Any) -> Any:
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, *args, **kwargs)
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name!r} is a {metric.kind}, not a {cls.kind}")
+        return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get_or_create(Counter, name, help)
+
+    def gauge(self, name: str, help: str = "") -> Gauge:
+        return self._get_or_create(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = "", **kwargs: Any) -> Histogram:
+        return self._get_or_create(Histogram, name, help, **kwargs)
+
+    def snapshot(self) -> dict[str, Any]:
+        """Aggregate all metrics over their thread shards."""
+        result: dict[str, Any] = dict(time=time.time(), counters={}, gauges={}, histograms={})
+        for name, metric in list(self._metrics.items()):
+            result[metric.kind + "s"][name] = metric.snapshot()
+        return result
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            prom_name = _prometheus_name(name)
+            if metric.help:
+                lines.append(f"# HELP {prom_name} {metric.help}")
+            lines.append(f"# TYPE {prom_name} {metric.kind}")
+            if metric.kind != "histogram":
+                lines.append(f"{prom_name} {_prometheus_value(metric.snapshot())}")
+                continue
+            merged = metric._merged()
+            cumulative = 0.0
+            for index, bucket_count in enumerate(merged[:-2]):
+                cumulative += bucket_count
+                lines.append(f'{prom_name}_bucket{{le="{_prometheus_value(metric.upper_bound(index))}"}} {int(cumulative)}')
+            lines.append(f"{prom_name}_sum {_prometheus_value(merged[-2])}")
+            lines.append(f"{prom_name}_count {int(merged[-1])}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str | Path, format: str = "prometheus") -> None:
+        """Write the metrics once: "prometheus" replaces the file atomically, "jsonl" appends one line."""
+        path = Path(path).expanduser()
+        if format == "prometheus":
+            temp_path = path.with_name(path.name + ".tmp")
+            temp_path.write_text(self.to_prometheus())
+            os.replace(temp_path, path)
+        elif format == "jsonl":
+            with open(path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+        else:
+            raise ValueError(f"Unsupported metrics format: {format}")
+
+    def start_exporter(self, path: str | Path, interval: float = 10.0, format: str = "prometheus") -> "_MetricsExporter":
+        """Export every `interval` seconds from a daemon thread, stop it with `.stop()` (which exports once more)."""
+        exporter = _MetricsExporter(self, path, interval, format)
+        self._exporters.append(exporter)
+        exporter.thread.start()
+        return exporter
+
+
+class _MetricsExporter():
+    def __init__(self, registry: MetricsRegistry, path: str | Path, interval: float, format: str):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.format = format
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="pyhelp-metrics-exporter", daemon=True)
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.registry.export(self.path, self.format)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.registry.export(self.path, self.format)
+
+
+metrics = MetricsRegistry()
 
 
 if __name__ == '__main__':
-    output = profiler(torch.min, torch.zeros(10000).cuda())
-    assert output['result'] == torch.zeros(10000).cuda().min()
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    output = profiler(torch.min, torch.zeros(10000, device=device))
+    assert output['result'] == torch.zeros(10000, device=device).min()
+    assert any(op.name == 'aten::min' for op in output['ops'])
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stacks_path = os.path.join(tmp_dir, 'stacks.txt')
+        output = profile(torch.min, (torch.zeros(10000, device=device),), warmup=1, steps=3, stacks_path=stacks_path)
+        assert os.path.getsize(stacks_path) > 0
+
+    output = timer(torch.min, torch.zeros(10000, device=device))
+    assert output == torch.zeros(10000, device=device).min()
 
-    output = timer(torch.min, torch.zeros(10000).cuda())
-    assert output == torch.zeros(10000).cuda().min()
+    stats = measure(torch.min, torch.zeros(10000, device=device), warmup=3, repeat=5, number=None)
+    print(stats)
+    assert stats.result == torch.zeros(10000, device=device).min()
@@ -1,22 +1,53 @@
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.transforms import Bbox
 from IPython.display import Image, display
 import numpy as np
+import io
+import math
+import threading
 import time
-import uuid
-import os
 import warnings
+from .streaming import StreamingSeries
+
+IMAGE_FORMATS = ('png', 'jpeg', 'raw')
+
 class NotebookFigure():
     """An extension of matplotlib figure to work with jupyter notebook's display module.
-    Works by storing the figure as an image on disk and loading it to display on updating.
+    Works by rendering the figure into an in-memory image and pushing the bytes to the display on updating.
     """
-    def __init__(self,image_path=None,nrows=1,ncols=1,decorate_fn=None,**subplot_kwargs):
+    def __init__(self,image_path=None,nrows=1,ncols=1,decorate_fn=None,image_format='png',jpeg_quality=90,
+                 async_render=False,min_interval_ms=100,blit=False,**subplot_kwargs):
         """
-        image_path: the filename of the stored figure image
+        image_path: if given, the figure image is also written to this file on every update
         decorate_fn: A function which takes in a 2d array of axes, and should perform
             basic plot decorations like labeling, title etc. It is called once.
-            
+        image_format: 'png' (savefig with tight bbox), 'jpeg' (cheaper to encode and send), or
+            'raw' (the RGBA canvas buffer encoded as a fast, lightly compressed png, no tight bbox)
+        jpeg_quality: quality of the 'jpeg' format
+        async_render: if True, update only marks the figure dirty and a background thread redraws
+            at most every min_interval_ms, the latest state wins. Use flush() to render immediately,
+            and optionally `with fig.lock:` around plotting calls to keep the renderer from drawing
+            half-updated axes (the lock is held while a frame is rendered).
+        blit: only redraw the axes changed since the last update (requires image_format='raw').
+            The figure background is cached and the changed axes are restored and redrawn onto the
+            last canvas. Axes are marked changed by append, set_xlim/set_ylim, plot/imshow and
+            mark_dirty; if none were marked the whole figure is redrawn. Call update(full=True)
+            after changing figure level artists (suptitle, size, ...).
+
         subplot_kwargs are passed to subplots' kwargs
         """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"image_format should be one of {IMAGE_FORMATS}, got {image_format}")
+        if blit and image_format != 'raw':
+            raise ValueError("blit requires image_format='raw', png and jpeg re-render the tight bbox every time")
+        self.image_format = image_format
+        self.blit = blit
+        self._dirty_axes = set()
+        self._background = None
+        self._axes_bboxes = {}
+        self._canvas_size = None
+        self.jpeg_quality = jpeg_quality
         
         self.nrows=nrows
         self.ncols=ncols
@@ -28,6 +59,8 @@ class NotebookFigure():
             decorate_fn(self.axes)
         
         plt.close(self.fig)
+        if not hasattr(self.fig.canvas, 'buffer_rgba'):
+            FigureCanvasAgg(self.fig) # closed figures lose their canvas, render offscreen with Agg
         
         
         self.image_path = image_path
@@ -38,34 +71,138 @@ class NotebookFigure():
         self.xlims = [[(None,None) for j in range(ncols)] for i in range(nrows)]
         self.ylims = [[(None,None) for j in range(ncols)] for i in range(nrows)]
         
-        if self.image_path is None:
-            self.temp_image_path = str(uuid.uuid4()) + "you_should_not_have_this_name.png"
-        self.save_fig()
+        if self.image_path is not None:
+            self.save_fig()
 
-        self.plot = self.getAxis().plot
-        self.imshow = self.getAxis().imshow
+        self.plot = self._marking(self.getAxis().plot)
+        self.imshow = self._marking(self.getAxis().imshow)
+
+        self.series = {}
+
+        self.lock = threading.RLock()
+        self.async_render = async_render
+        self.min_interval = min_interval_ms / 1000.0
+        self._dirty = threading.Event()
+        self._pending_lims = False
+        self._closed = False
+        self._last_render = 0.0
+        self._render_thread = None
+        if async_render:
+            self._render_thread = threading.Thread(target=self._render_loop, name="NotebookFigure-render", daemon=True)
+            self._render_thread.start()
 
-    def __del__(self):
-        temp_image_path = getattr(self, 'temp_image_path', None)
-        if temp_image_path is not None:
-            if os.path.isfile(temp_image_path):
-                os.remove(temp_image_path)
-    
-     
     def set_image_path(self, image_path):
-        """Sets the path for saving the figure image. This path must be set(either in init
-        or using this function) before display can be called."""
+        """Sets the path for saving the figure image, it is written on every update from now on.
+        Setting it to None stops writing to disk."""
         
         self.image_path = image_path
-        self.fig.savefig(image_path, bbox_inches='tight')
+        if image_path is not None:
+            self.save_fig()
+
+    def _marking(self, plot_fn, axis_num=0):
+        def wrapped(*args, **kwargs):
+            self.mark_dirty(axis_num)
+            return plot_fn(*args, **kwargs)
+        return wrapped
+
+    def mark_dirty(self, axis_num=0):
+        """Mark the axis indexed row major wise as changed, it is redrawn on the next update.
+        Only needed when the axis is modified directly (e.g. through getAxis)."""
+        self._dirty_axes.add(self.getAxis(axis_num))
+
+    def render(self, dirty_axes=None):
+        """Render the figure into image bytes of self.image_format, no disk access.
+        dirty_axes: with blit, only these axes are redrawn onto the last canvas (None redraws all)."""
+        buffer = io.BytesIO()
+        if self.image_format == 'png':
+            self.fig.savefig(buffer, format='png', bbox_inches='tight')
+            return buffer.getvalue()
+        if self.image_format == 'jpeg':
+            self.fig.savefig(buffer, format='jpeg', bbox_inches='tight', pil_kwargs={'quality': self.jpeg_quality})
+            return buffer.getvalue()
+        if self.blit and dirty_axes is not None:
+            self._blit_axes(dirty_axes)
+        else:
+            self._draw_full()
+        return self.encode_canvas()
+
+    def _draw_full(self):
+        canvas = self.fig.canvas
+        if self.blit:
+            # cache the background: the figure without any axes
+            visible = [ax.get_visible() for ax in self.fig.axes]
+            for ax in self.fig.axes:
+                ax.set_visible(False)
+            canvas.draw()
+            self._background = canvas.copy_from_bbox(self.fig.bbox)
+            for ax, was_visible in zip(self.fig.axes, visible):
+                ax.set_visible(was_visible)
+        canvas.draw()
+        if self.blit:
+            renderer = canvas.get_renderer()
+            self._axes_bboxes = {ax: ax.get_tightbbox(renderer) for ax in self.fig.axes if ax.get_visible()}
+            self._canvas_size = canvas.get_width_height()
+
+    def _blit_axes(self, dirty_axes):
+        """Restore the background under the changed axes (old and new extent) and redraw them,
+        together with the axes overlapping the restored regions."""
+        canvas = self.fig.canvas
+        axes = [ax for ax in self.fig.axes if ax.get_visible()]
+        if (self._background is None or canvas.get_width_height() != self._canvas_size
+                or set(axes) != set(self._axes_bboxes) or set(axes) <= set(dirty_axes)):
+            self._draw_full()
+            return
+        renderer = canvas.get_renderer()
+        bboxes = {ax: ax.get_tightbbox(renderer) for ax in axes if ax in dirty_axes}
+        regions = [Bbox.union([self._axes_bboxes[ax], bbox]).padded(1) for ax, bbox in bboxes.items()]
+
+        redraw = set(bboxes)
+        grown = True
+        while grown:
+            grown = False
+            for ax in axes:
+                if ax not in redraw and any(self._axes_bboxes[ax].overlaps(region) for region in regions):
+                    redraw.add(ax)
+                    regions.append(self._axes_bboxes[ax].padded(1))
+                    grown = True
+
+        width, height = self._canvas_size
+        for region in regions:
+            x0, y0 = max(math.floor(region.x0), 0), max(math.floor(region.y0), 0)
+            x1, y1 = min(math.ceil(region.x1), width), min(math.ceil(region.y1), height)
+            if x1 > x0 and y1 > y0:
+                # the region bbox is in buffer coordinates (origin top left)
+                canvas.restore_region(self._background, bbox=(x0, height - y1, x1, height - y0), xy=(0, 0))
+        for ax in sorted(axes, key=lambda ax: ax.get_zorder()):
+            if ax in redraw:
+                self.fig.draw_artist(ax)
+                self._axes_bboxes[ax] = bboxes.get(ax, self._axes_bboxes[ax])
+
+    def encode_canvas(self):
+        """Encode the already drawn canvas buffer as a fast png (compress_level=1)."""
+        from PIL import Image as PILImage
+        buffer = io.BytesIO()
+        rgba = np.asarray(self.fig.canvas.buffer_rgba())
+        PILImage.fromarray(rgba).save(buffer, format='png', compress_level=1)
+        return buffer.getvalue()
+
+    def _to_display_image(self, data):
+        return Image(data=data, format='jpeg' if self.image_format == 'jpeg' else 'png')
+
+    def _write_image(self, data):
+        if self.image_path is not None:
+            with open(self.image_path, 'wb') as f:
+                f.write(data)
     
-    def update_lims(self):
+    def update_lims(self, axes=None):
         """
-        Updates lims of all axes
+        Updates lims of all axes (or only of the given axes)
         """
         for i in range(self.nrows):
             for j in range(self.ncols):
                 ax = self.axes[i][j]
+                if axes is not None and ax not in axes:
+                    continue
                 ax.relim()
 #                 ax.autoscale_view()
                 ax.autoscale()
@@ -79,6 +216,7 @@ class NotebookFigure():
         row = axis_num // self.ncols
         col = axis_num % self.ncols
         self.xlims[row][col]=xlim
+        self.mark_dirty(axis_num)
         self.update()
 
     def set_ylim(self,ylim,axis_num=0):
@@ -88,24 +226,92 @@ class NotebookFigure():
         row = axis_num // self.ncols
         col = axis_num % self.ncols
         self.ylims[row][col]=ylim
+        self.mark_dirty(axis_num)
         self.update()
         
     def display(self):
         """Create a display of the figure"""
-        image_path = self.image_path if self.image_path is not None else self.temp_image_path
-        self.disp = display(Image(image_path),display_id=f"{id(self)}_{time.time()}")
+        self.disp = display(self._to_display_image(self.render()),display_id=f"{id(self)}_{time.time()}")
     
-    def update(self, update_lims=True):
-        """Update the lims(if set to True) and update all display instances"""
-        if update_lims:
-            self.update_lims()
-        if self.disp is None:
-            warnings.warn("The figure has not been displayed. Please display before update")
+    def update(self, update_lims=True, full=False):
+        """Update the lims(if set to True) and update all display instances.
+        full: with blit, redraw the whole figure and refresh the cached background.
+        In async mode the figure is only marked dirty, the background renderer picks it up."""
+        if full:
+            self._background = None
+            self._dirty_axes.update(self.axes.flat)
+        if self.async_render:
+            self._pending_lims = self._pending_lims or update_lims
+            self._dirty.set()
             return
-        image_path = self.image_path if self.image_path is not None else self.temp_image_path
-        self.fig.savefig(image_path, bbox_inches='tight')
-        self.disp.update(Image(image_path))
+        self._update_display(update_lims)
+
+    def _update_display(self, update_lims):
+        with self.lock:
+            dirty_axes, self._dirty_axes = self._dirty_axes, set()
+            if not self.blit or not dirty_axes:
+                dirty_axes = None # nothing tracked, treat every axis as changed
+            for series in self.series.values():
+                series.refresh()
+            if update_lims:
+                self.update_lims(dirty_axes)
+            if self.disp is None:
+                warnings.warn("The figure has not been displayed. Please display before update")
+                return
+            data = self.render(dirty_axes)
+            self._write_image(data)
+            self.disp.update(self._to_display_image(data))
+            self._last_render = time.perf_counter()
+
+    def _render_pending(self):
+        self._dirty.clear()
+        update_lims, self._pending_lims = self._pending_lims, False
+        self._update_display(update_lims)
+
+    def _render_loop(self):
+        while True:
+            self._dirty.wait()
+            if self._closed:
+                return
+            # coalesce the updates arriving within min_interval, the latest state wins
+            time.sleep(max(self._last_render + self.min_interval - time.perf_counter(), 0.0))
+            if not self._dirty.is_set():
+                continue # flushed in the meantime
+            try:
+                self._render_pending()
+            except Exception as e:
+                warnings.warn(f"NotebookFigure background rendering failed: {e!r}")
+
+    def flush(self):
+        """Render pending updates now (async mode), returns after the display is updated."""
+        if self._dirty.is_set():
+            self._render_pending()
+
+    def close(self):
+        """Render pending updates and stop the background renderer."""
+        self.flush()
+        self._closed = True
+        self._dirty.set()
+        if self._render_thread is not None:
+            self._render_thread.join()
+            self._render_thread = None
     
+    def append(self, series, x, y, axis_num=0, window=None, max_points=2000, **line_kwargs):
+        """Append points to a streaming line series, created on the first call.
+        series: name of the series (also the line label)
+        window: keep only the last `window` points (ring buffer), None keeps the whole history
+        max_points: the line gets a LTTB decimation of the history with at most this many points
+        line_kwargs are passed to plot when the line is created.
+        Decimation happens when the figure is rendered, call update() as usual."""
+        streaming_series = self.series.get(series)
+        if streaming_series is None:
+            with self.lock:
+                line, = self.getAxis(axis_num).plot([], [], label=series, **line_kwargs)
+            streaming_series = self.series[series] = StreamingSeries(line, window=window, max_points=max_points)
+        streaming_series.append(x, y)
+        self._dirty_axes.add(streaming_series.line.axes)
+        return streaming_series
+
     def getAxis(self,axis_num=0):
         """Get the axis in the subplot indexed row major wise starting from 0."""
         row = axis_num // self.ncols
@@ -113,8 +319,11 @@ class NotebookFigure():
         return self.axes[row][col]
     
     def save_fig(self):
-        image_path = self.image_path if self.image_path is not None else self.temp_image_path
-        self.fig.savefig(image_path, bbox_inches='tight')
+        """Write the figure image to image_path."""
+        if self.image_path is None:
+            warnings.warn("image_path is not set, nothing is saved")
+            return
+        self._write_image(self.render())
 
     def show(self):
         self.display()
@@ -124,3 +333,5 @@ class NotebookFigure():
         for i in range(self.nrows):
             for j in range(self.ncols):
                 self.axes[i, j].clear()
+        self.series = {}
+        self._dirty_axes.update(self.axes.flat)
@@ -0,0 +1,140 @@
+"""
+    Streaming line series for NotebookFigure: numpy-backed history and visually faithful decimation.
+"""
+import numpy as np
+
+
+def lttb(x, y, num_out):
+    """Largest-Triangle-Three-Buckets decimation of the series (x, y) to num_out points.
+
+    Vectorized variant: the anchor of each triangle is the average of the previous bucket instead of
+    the point selected there, so all buckets are solved in one pass of numpy operations.
+    The first and last points are always kept.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if num_out >= n or num_out < 3:
+        return x, y
+
+    num_buckets = num_out - 2
+    edges = np.linspace(1, n - 1, num_buckets + 1).astype(np.int64) # buckets over the interior points
+    starts = edges[:-1]
+    sizes = np.diff(edges)
+    interior_x, interior_y = x[1:n - 1], y[1:n - 1]
+    avg_x = np.add.reduceat(interior_x, starts - 1) / sizes
+    avg_y = np.add.reduceat(interior_y, starts - 1) / sizes
+
+    # anchor a: previous bucket average (first point for the first bucket)
+    # anchor c: next bucket average (last point for the last bucket)
+    a_x = np.concatenate([x[:1], avg_x[:-1]])
+    a_y = np.concatenate([y[:1], avg_y[:-1]])
+    c_x = np.concatenate([avg_x[1:], x[-1:]])
+    c_y = np.concatenate([avg_y[1:], y[-1:]])
+
+    bucket = np.repeat(np.arange(num_buckets), sizes)
+    area = np.abs((a_x[bucket] - c_x[bucket]) * (interior_y - a_y[bucket])
+                  - (a_x[bucket] - interior_x) * (c_y[bucket] - a_y[bucket]))
+    area = np.where(np.isnan(area), -1.0, area)
+
+    # first index of the maximum area in every bucket
+    order = np.lexsort((-area, bucket))
+    first = np.concatenate([[True], bucket[order][1:] != bucket[order][:-1]])
+    selected = order[first] + 1
+    index = np.concatenate([[0], selected, [n - 1]])
+    return x[index], y[index]
+
+
+class StreamingSeries():
+    """Points of one Line2D kept in a growing (or fixed-size ring) numpy buffer.
+
+    Only a decimated version (at most max_points) is handed to the line with set_data. For growing
+    histories, finished chunks are folded into a level-of-detail cache, so the cost of a refresh is
+    bounded by a few times max_points however long the history gets.
+    """
+    def __init__(self, line, window=None, max_points=2000, initial_capacity=1024):
+        """
+        line: the matplotlib Line2D to feed
+        window: if given, only the last `window` points are kept (ring buffer)
+        max_points: number of points handed to the line
+        """
+        self.line = line
+        self.window = window
+        self.max_points = max_points
+        capacity = window if window else initial_capacity
+        self._x = np.empty(capacity, dtype=np.float64)
+        self._y = np.empty(capacity, dtype=np.float64)
+        self._start = 0 # ring head
+        self._size = 0
+        self.num_appended = 0
+        self.dirty = False
+        self._chunk = 4 * max_points
+        self._lod_x = np.empty(0)
+        self._lod_y = np.empty(0)
+        self._lod_end = 0 # raw points [0, _lod_end) are represented by the lod cache
+
+    def __len__(self):
+        return self._size
+
+    def append(self, x, y):
+        """Append one point or arrays of points."""
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64)).reshape(-1)
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64)).reshape(-1)
+        if len(x) != len(y):
+            raise ValueError(f"x and y should have the same length, got {len(x)} and {len(y)}")
+        self.num_appended += len(x)
+        self.dirty = True
+        if self.window:
+            self._append_ring(x, y)
+        else:
+            self._append_growing(x, y)
+
+    def _append_growing(self, x, y):
+        needed = self._size + len(x)
+        if needed > len(self._x):
+            capacity = max(needed, 2 * len(self._x))
+            self._x = np.concatenate([self._x[:self._size], np.empty(capacity - self._size)])
+            self._y = np.concatenate([self._y[:self._size], np.empty(capacity - self._size)])
+        self._x[self._size:needed] = x
+        self._y[self._size:needed] = y
+        self._size = needed
+
+    def _append_ring(self, x, y):
+        if len(x) >= self.window:
+            x, y = x[-self.window:], y[-self.window:]
+        index = (self._start + self._size + np.arange(len(x))) % self.window
+        self._x[index] = x
+        self._y[index] = y
+        overflow = max(self._size + len(x) - self.window, 0)
+        self._start = (self._start + overflow) % self.window
+        self._size = min(self._size + len(x), self.window)
+
+    def data(self):
+        """The stored points (x, y) in order."""
+        if not self.window:
+            return self._x[:self._size], self._y[:self._size]
+        index = (self._start + np.arange(self._size)) % self.window
+        return self._x[index], self._y[index]
+
+    def decimated(self):
+        """At most max_points points representing the stored series."""
+        if self.window:
+            x, y = self.data()
+            return lttb(x, y, self.max_points)
+
+        tail_x, tail_y = self._x[self._lod_end:self._size], self._y[self._lod_end:self._size]
+        if len(tail_x) >= self._chunk:
+            chunk_x, chunk_y = lttb(tail_x, tail_y, self._chunk // 4)
+            self._lod_x = np.concatenate([self._lod_x, chunk_x])
+            self._lod_y = np.concatenate([self._lod_y, chunk_y])
+            self._lod_end = self._size
+            if len(self._lod_x) > self._chunk:
+                self._lod_x, self._lod_y = lttb(self._lod_x, self._lod_y, self._chunk // 2)
+            tail_x, tail_y = tail_x[:0], tail_y[:0]
+        return lttb(np.concatenate([self._lod_x, tail_x]), np.concatenate([self._lod_y, tail_y]), self.max_points)
+
+    def refresh(self):
+        """Hand the decimated points to the line if new points were appended."""
+        if self.dirty:
+            self.line.set_data(*self.decimated())
+            self.dirty = False
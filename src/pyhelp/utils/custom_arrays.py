@@ -0,0 +1,93 @@
+"""
+    Binary storage of an mmdetection "custom" dataset: all the boxes of all images in one float32 array,
+    the labels in one int64 array and per-image offsets, one .npy file each, so a dataset opens
+    instantly and can be memory mapped.
+
+    Directory layout:
+        meta.json       version, number of images and objects
+        filenames.npy   [num_images] str
+        sizes.npy       [num_images, 2] int64, height and width
+        offsets.npy     [num_images + 1] int64, the objects of image i are [offsets[i], offsets[i + 1])
+        bboxes.npy      [num_objects, 4] float32, left top right bottom
+        labels.npy      [num_objects] int64
+
+    Example:
+        annotations = CustomArrays.load("kitti_custom", mmap=True)
+        sample = annotations[7] # {'filename':..., 'height':..., 'width':..., 'ann': {'bboxes': ndarray, 'labels': ndarray}}
+        data_infos = annotations.to_records() # the list CustomDataset.load_annotations returns
+"""
+import json
+import os
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+VERSION = 1
+ARRAY_NAMES = ['filenames', 'sizes', 'offsets', 'bboxes', 'labels']
+
+
+class CustomArrays():
+    """Annotations of a "custom" dataset as concatenated arrays with per-image offsets."""
+    def __init__(self, filenames:np.ndarray, sizes:np.ndarray, offsets:np.ndarray, bboxes:np.ndarray, labels:np.ndarray):
+        self.filenames = filenames
+        self.sizes = sizes
+        self.offsets = offsets
+        self.bboxes = bboxes
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, index:int)->Dict[str, Any]:
+        """The "custom" annotation dict of image index, bboxes and labels are views of the arrays."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return {
+            'filename': str(self.filenames[index]),
+            'height': int(self.sizes[index, 0]),
+            'width': int(self.sizes[index, 1]),
+            'ann': {'bboxes': self.bboxes[start:end], 'labels': self.labels[start:end]},
+        }
+
+    def to_records(self)->List[Dict[str, Any]]:
+        return [self[i] for i in range(len(self))]
+
+    @staticmethod
+    def from_records(records:Sequence[Dict[str, Any]])->'CustomArrays':
+        """Build from "custom" annotation dicts (bboxes / labels as lists or arrays)."""
+        bboxes = [np.asarray(record['ann']['bboxes'], dtype=np.float32).reshape(-1, 4) for record in records]
+        labels = [np.asarray(record['ann']['labels'], dtype=np.int64).reshape(-1) for record in records]
+        counts = [len(labels_of_image) for labels_of_image in labels]
+        return CustomArrays(
+            np.array([record['filename'] for record in records], dtype=str),
+            np.array([[record['height'], record['width']] for record in records], dtype=np.int64).reshape(-1, 2),
+            np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64),
+            np.concatenate(bboxes) if records else np.zeros((0, 4), dtype=np.float32),
+            np.concatenate(labels) if records else np.zeros(0, dtype=np.int64))
+
+    def save(self, output_dir:str):
+        """Write the arrays into output_dir (created if missing), meta.json is written last."""
+        os.makedirs(output_dir, exist_ok=True)
+        for name in ARRAY_NAMES:
+            path = os.path.join(output_dir, name + '.npy')
+            with open(path + '.tmp', 'wb') as f: # a file object keeps np.save from appending .npy
+                np.save(f, getattr(self, name))
+            os.replace(path + '.tmp', path)
+        meta = dict(version=VERSION, num_images=len(self), num_objects=len(self.labels))
+        with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @staticmethod
+    def load(input_dir:str, mmap:bool=False)->'CustomArrays':
+        """Load arrays saved with save, mmap memory maps the offsets, boxes and labels instead of reading them."""
+        with open(os.path.join(input_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') != VERSION:
+            raise ValueError(f"{input_dir} was saved with format version {meta.get('version')}, expected {VERSION}")
+        arrays:Dict[str, np.ndarray] = {}
+        for name in ARRAY_NAMES:
+            path = os.path.join(input_dir, name + '.npy')
+            if mmap and name in ('offsets', 'bboxes', 'labels'):
+                arrays[name] = np.load(path, mmap_mode='r')
+            else:
+                arrays[name] = np.load(path)
+        return CustomArrays(**arrays)
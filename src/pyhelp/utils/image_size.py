@@ -0,0 +1,141 @@
+"""
+    Read image width and height from the file header (PNG IHDR, JPEG SOF, GIF, BMP) without decoding,
+    with an optional on-disk cache keyed by path, mtime and file size.
+"""
+import json
+import os
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pyhelp.utils.parallel import ordered_map
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# SOF markers carry the frame size, 0xC4 (DHT), 0xC8 (JPG) and 0xCC (DAC) share the range but do not
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(file)->Optional[Tuple[int, int]]:
+    file.seek(2)
+    while True:
+        byte = file.read(1)
+        while byte and byte != b'\xff':
+            byte = file.read(1)
+        while byte == b'\xff': # fill bytes
+            byte = file.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9: # standalone markers, no length
+            continue
+        length_bytes = file.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            segment = file.read(5)
+            if len(segment) < 5:
+                return None
+            height, width = struct.unpack('>HH', segment[1:5])
+            return width, height
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def read_header_size(path:str)->Optional[Tuple[int, int]]:
+    """(width, height) from the header of a PNG, JPEG, GIF or BMP file, None for other formats."""
+    with open(path, 'rb') as file:
+        head = file.read(26)
+        if head.startswith(PNG_SIGNATURE) and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] == b'\xff\xd8':
+            return _jpeg_size(file)
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:2] == b'BM' and len(head) >= 26:
+            width, height = struct.unpack('<ii', head[18:26])
+            return width, abs(height) # negative height for top-down bitmaps
+    return None
+
+
+def _decode_size(path:str)->Tuple[int, int]:
+    try:
+        from PIL import Image
+    except ImportError:
+        pass
+    else:
+        with Image.open(path) as pil_image:
+            return pil_image.size
+    import cv2
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"Can not read image size of {path}")
+    return image.shape[1], image.shape[0]
+
+
+def read_image_size(path:str)->Tuple[int, int]:
+    """Return (width, height) of an image.
+
+    Only the header is read for PNG, JPEG, GIF and BMP files, other formats fall back to PIL
+    (or cv2 if PIL is not installed).
+    """
+    size = read_header_size(path)
+    if size is None:
+        size = _decode_size(path)
+    return int(size[0]), int(size[1])
+
+
+class ImageSizeCache():
+    """Image sizes persisted in a json file, an entry is valid while the mtime and size of the file are unchanged.
+
+    Example:
+        cache = ImageSizeCache("sizes.json")
+        sizes = cache.sizes(image_paths, workers=8)
+        cache.save()
+    """
+    VERSION = 1
+
+    def __init__(self, cache_file:str):
+        self.cache_file = cache_file
+        self.entries:Dict[str, List[int]] = {} # path -> [mtime_ns, file_size, width, height]
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                content = json.load(f)
+            if content.get("version") == self.VERSION:
+                self.entries = content["entries"]
+        self._changed = False
+
+    def _signature(self, path:str)->Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def lookup(self, path:str)->Optional[Tuple[int, int]]:
+        """Cached (width, height) of path, None if missing or outdated."""
+        entry = self.entries.get(path)
+        if entry is None or tuple(entry[:2]) != self._signature(path):
+            return None
+        return entry[2], entry[3]
+
+    def get(self, path:str)->Tuple[int, int]:
+        """(width, height) of path, read and cached on a miss."""
+        return self.sizes([path])[0]
+
+    def sizes(self, paths:Sequence[str], workers:int=0)->List[Tuple[int, int]]:
+        """(width, height) of every path, the misses are read with `workers` processes."""
+        result:List[Optional[Tuple[int, int]]] = [self.lookup(path) for path in paths]
+        missing = [path for path, size in zip(paths, result) if size is None]
+        read_sizes = iter(ordered_map(read_image_size, missing, workers=workers))
+        for i, path in enumerate(paths):
+            if result[i] is None:
+                result[i] = size = next(read_sizes)
+                self.entries[path] = [*self._signature(path), size[0], size[1]]
+                self._changed = True
+        return result # type: ignore
+
+    def save(self):
+        """Write the cache file if entries were added or refreshed."""
+        if not self._changed:
+            return
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({"version":self.VERSION, "entries":self.entries}, f)
+        os.replace(tmp_file, self.cache_file)
+        self._changed = False
@@ -0,0 +1,120 @@
+"""
+    Write large json documents record by record with constant memory.
+    The output is the same as json.dump of the whole document (default separators).
+"""
+import json
+import shutil
+import tempfile
+from typing import Any, Optional, TextIO
+
+_encode = json.JSONEncoder().encode # the C encoder, same output as json.dump
+
+
+def round_floats(obj:Any, float_precision:Optional[int])->Any:
+    """Round every float in nested dicts / lists / tuples to float_precision decimals.
+    Rounded floats have short reprs, which are faster to encode and smaller on disk."""
+    if float_precision is None:
+        return obj
+    if isinstance(obj, float):
+        return round(obj, float_precision)
+    if isinstance(obj, dict):
+        return {key: round_floats(value, float_precision) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [round_floats(value, float_precision) for value in obj]
+    return obj
+
+
+class JsonListWriter():
+    """Write a json list item by item into an open text file.
+
+    Example:
+        with open("out.json", "w") as f, JsonListWriter(f) as writer:
+            for record in records:
+                writer.write(record)
+    """
+    def __init__(self, file:TextIO, float_precision:Optional[int]=None, brackets:bool=True):
+        """
+        float_precision: if given, floats are rounded to this many decimals
+        brackets: write the enclosing '[' and ']', False only writes the comma separated items
+        """
+        self.file = file
+        self.float_precision = float_precision
+        self.brackets = brackets
+        self.count = 0
+        if brackets:
+            self.file.write('[')
+
+    def write(self, item:Any):
+        if self.count:
+            self.file.write(', ')
+        self.file.write(_encode(round_floats(item, self.float_precision)))
+        self.count += 1
+
+    def close(self):
+        if self.brackets:
+            self.file.write(']')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SpooledJsonList(JsonListWriter):
+    """A json list encoded into a temporary file, for a list produced together with another streamed
+    list but written after it (e.g. COCO annotations while the images are streamed)."""
+    def __init__(self, float_precision:Optional[int]=None):
+        super().__init__(tempfile.TemporaryFile('w+', encoding='utf-8'), float_precision, brackets=False)
+
+    def copy_to(self, file:TextIO):
+        """Write the spooled items (without brackets) to file."""
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, file)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonObjectWriter():
+    """Write a json object field by field into an open text file, list fields can be streamed.
+
+    Example:
+        with open("coco.json", "w") as f:
+            writer = JsonObjectWriter(f)
+            writer.write_field("info", info)
+            with writer.begin_list("images") as images:
+                for image in image_records:
+                    images.write(image)
+            writer.write_field("categories", categories)
+            writer.close()
+    """
+    def __init__(self, file:TextIO, float_precision:Optional[int]=None):
+        self.file = file
+        self.float_precision = float_precision
+        self.count = 0
+        self.file.write('{')
+
+    def _write_key(self, key:str):
+        if self.count:
+            self.file.write(', ')
+        self.file.write(_encode(key) + ': ')
+        self.count += 1
+
+    def write_field(self, key:str, value:Any):
+        self._write_key(key)
+        self.file.write(_encode(round_floats(value, self.float_precision)))
+
+    def begin_list(self, key:str)->JsonListWriter:
+        """Start a list field, the returned writer must be closed before the next field."""
+        self._write_key(key)
+        return JsonListWriter(self.file, self.float_precision)
+
+    def write_spooled_list(self, key:str, spooled:SpooledJsonList):
+        self._write_key(key)
+        self.file.write('[')
+        spooled.copy_to(self.file)
+        self.file.write(']')
+
+    def close(self):
+        self.file.write('}')
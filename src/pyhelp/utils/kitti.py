@@ -0,0 +1,320 @@
+"""
+    KITTI dataset helpers.
+
+    Columnar label reader: every object of a label_2 directory in one set of numpy columns,
+    with per-frame offsets, parsed in bulk and optionally cached as a binary npz file.
+
+    Example:
+        labels = read_kitti_labels("training/label_2", cache_file="label_2_cache.npz")
+        keep = labels.class_mask(['Car', 'Pedestrian', 'Cyclist']) & (labels['occluded'] <= 2)
+        cars = labels.select(keep)
+        boxes_of_frame_7 = cars['bbox'][cars.frame_slice(7)]
+
+    Catalog: frame id -> image / label / calib files of a training or testing directory, built with
+    os.scandir, optionally persisted as an npz index, with vectorized split selection.
+
+    Example:
+        catalog = KittiCatalog.open("training", index_file="training_index.npz")
+        train = catalog.labeled().select_ids(read_split_ids("train.txt"))
+        labels = read_kitti_labels(train.directory('label'), train.names('label'))
+"""
+import functools
+import hashlib
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from pyhelp.utils.parallel import ordered_map
+
+KITTI_CLASSES = ['Car', 'Van', 'Truck', 'Pedestrian', 'Person_sitting', 'Cyclist', 'Tram', 'Misc', 'DontCare']
+
+# name, number of values, dtype; the optional 16th value is the score of detection results
+LABEL_COLUMNS = [
+    ('type', 1, str),
+    ('truncated', 1, np.float64),
+    ('occluded', 1, np.int8),
+    ('alpha', 1, np.float64),
+    ('bbox', 4, np.float64), # left, top, right, bottom
+    ('dimensions', 3, np.float64), # height, width, length
+    ('location', 3, np.float64),
+    ('rotation_y', 1, np.float64),
+    ('score', 1, np.float64), # nan for ground truth labels
+]
+CACHE_VERSION = 1
+
+
+class KittiLabels():
+    """Objects of several KITTI label files in columns.
+
+    labels[column] is an array over all objects (bbox is [N, 4] ...), the objects of frame f
+    are labels[column][labels.frame_slice(f)], frames holds the label file stems ('000007').
+    """
+    def __init__(self, frames:np.ndarray, offsets:np.ndarray, columns:Dict[str, np.ndarray]):
+        self.frames = frames
+        self.offsets = offsets
+        self.columns = columns
+
+    def __getitem__(self, column:str)->np.ndarray:
+        return self.columns[column]
+
+    def __len__(self):
+        return len(self.columns['type'])
+
+    @property
+    def num_frames(self)->int:
+        return len(self.frames)
+
+    def frame_slice(self, frame:int)->slice:
+        return slice(self.offsets[frame], self.offsets[frame + 1])
+
+    def frame_index(self)->np.ndarray:
+        """Frame number of every object."""
+        return np.repeat(np.arange(self.num_frames), np.diff(self.offsets))
+
+    def class_mask(self, class_names:Sequence[str])->np.ndarray:
+        return np.isin(self.columns['type'], class_names)
+
+    def class_ids(self, class_names:Sequence[str])->np.ndarray:
+        """Index of every object's type in class_names, -1 for other types."""
+        names, inverse = np.unique(self.columns['type'], return_inverse=True)
+        lookup = np.array([class_names.index(name) if name in class_names else -1 for name in names], dtype=np.int64)
+        return lookup[inverse.reshape(-1)]
+
+    def select(self, mask:np.ndarray)->'KittiLabels':
+        """Keep the objects where mask is True, all frames are kept (possibly empty)."""
+        counts = np.bincount(self.frame_index()[mask], minlength=self.num_frames)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return KittiLabels(self.frames, offsets, {name: values[mask] for name, values in self.columns.items()})
+
+    def save(self, path:str, key:str=''):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f: # a file object keeps np.savez from appending .npz
+            arrays:Dict[str, Any] = dict(version=CACHE_VERSION, key=key, frames=self.frames, offsets=self.offsets, **self.columns)
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path:str, key:Optional[str]=None)->Optional['KittiLabels']:
+        """Load labels saved with save, None if the file is missing, outdated or saved with another key."""
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as content:
+            if int(content['version']) != CACHE_VERSION or (key is not None and str(content['key']) != key):
+                return None
+            columns = {name: content[name] for name, _, _ in LABEL_COLUMNS}
+            return KittiLabels(content['frames'], content['offsets'], columns)
+
+    @staticmethod
+    def concatenate(parts:Sequence['KittiLabels'])->'KittiLabels':
+        if not parts:
+            return _empty_labels()
+        offsets = [parts[0].offsets[:1]]
+        start = 0
+        for part in parts:
+            offsets.append(part.offsets[1:] + start)
+            start += part.offsets[-1]
+        columns = {name: np.concatenate([part.columns[name] for part in parts]) for name, _, _ in LABEL_COLUMNS}
+        return KittiLabels(np.concatenate([part.frames for part in parts]), np.concatenate(offsets), columns)
+
+
+def _empty_labels()->KittiLabels:
+    columns = {name: np.zeros((0, width) if width > 1 else 0, dtype=dtype) for name, width, dtype in LABEL_COLUMNS}
+    return KittiLabels(np.zeros(0, dtype=str), np.zeros(1, dtype=np.int64), columns)
+
+
+def _columns_from_values(types:np.ndarray, values:np.ndarray)->Dict[str, np.ndarray]:
+    """Typed columns from the type names and the [N, 15] values (score nan for ground truth)."""
+    columns = {'type': types}
+    start = 0
+    for name, width, dtype in LABEL_COLUMNS[1:]:
+        column = values[:, start:start + width]
+        columns[name] = (column if width > 1 else column[:, 0]).astype(dtype)
+        start += width
+    return columns
+
+
+def parse_label_files(label_dir:str, files:Sequence[str])->KittiLabels:
+    """Parse the label files in one bulk pass: each file is split into tokens and all the values are
+    converted by numpy at once."""
+    types:List[str] = []
+    values:Dict[int, List[str]] = {15: [], 16: []} # numeric tokens of ground truth (15 values per line) and result (16) files
+    has_score:List[np.ndarray] = []
+    counts = []
+    for file in files:
+        with open(os.path.join(label_dir, file), 'r') as f:
+            text = f.read()
+        tokens = text.split()
+        lines = text.split('\n')
+        num_lines = len(lines) - lines.count('')
+        if num_lines and len(tokens) % num_lines:
+            num_lines = sum(1 for line in lines if line.strip()) # whitespace only lines
+        num_fields = len(tokens) // num_lines if num_lines else 15
+        if num_fields not in (15, 16) or num_fields * num_lines != len(tokens):
+            raise ValueError(f"Malformed KITTI label file {os.path.join(label_dir, file)}")
+        types.extend(tokens[0::num_fields])
+        del tokens[0::num_fields]
+        values[num_fields].extend(tokens)
+        has_score.append(np.full(num_lines, num_fields == 16))
+        counts.append(num_lines)
+
+    ground_truth = np.array(values[15], dtype=np.float64).reshape(-1, 14)
+    ground_truth = np.concatenate([ground_truth, np.full((len(ground_truth), 1), np.nan)], axis=1)
+    results = np.array(values[16], dtype=np.float64).reshape(-1, 15)
+    if not len(results):
+        table = ground_truth
+    elif not len(ground_truth):
+        table = results
+    else:
+        mask = np.concatenate(has_score)
+        table = np.empty((len(mask), 15), dtype=np.float64)
+        table[mask] = results
+        table[~mask] = ground_truth
+
+    frames = np.array([os.path.splitext(file)[0] for file in files], dtype=str)
+    offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+    return KittiLabels(frames, offsets, _columns_from_values(np.array(types, dtype=str), table))
+
+
+def directory_state_key(label_dir:str, files:Sequence[str])->str:
+    """Digest of the names, mtimes and sizes of the files, changes whenever a label file does."""
+    digest = hashlib.blake2b(digest_size=16)
+    for file in files:
+        stat = os.stat(os.path.join(label_dir, file))
+        digest.update(f"{file}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+def read_kitti_labels(label_dir:str, files:Optional[Sequence[str]]=None, workers:int=0,
+                      cache_file:Optional[str]=None, chunk_size:int=1024)->KittiLabels:
+    """Read KITTI label files into a KittiLabels.
+
+    Args:
+        label_dir (str): the label_2 directory
+        files (Sequence[str], optional): label file names in order, defaults to the sorted .txt files of label_dir
+        workers (int): number of processes parsing chunks of files, 0 parses in this process
+        cache_file (str, optional): npz file caching the parsed labels, reused while the names, mtimes and
+            sizes of the files are unchanged
+        chunk_size (int): files per worker task
+    """
+    if files is None:
+        files = sorted(entry.name for entry in os.scandir(label_dir) if entry.name.endswith('.txt'))
+    key = ''
+    if cache_file is not None:
+        key = directory_state_key(label_dir, files)
+        labels = KittiLabels.load(cache_file, key)
+        if labels is not None:
+            return labels
+
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+    parts = list(ordered_map(functools.partial(parse_label_files, label_dir), chunks,
+                             workers=workers if len(chunks) > 1 else 0, chunksize=1))
+    labels = KittiLabels.concatenate(parts)
+    if cache_file is not None:
+        labels.save(cache_file, key)
+    return labels
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+CATALOG_DIRECTORIES = {'image': ('image_2', IMAGE_EXTENSIONS), 'label': ('label_2', ('.txt',)), 'calib': ('calib', ('.txt',))}
+
+
+def read_split_ids(split_file:str)->np.ndarray:
+    """Frame ids listed in a split file (one integer per line, e.g. ImageSets/train.txt)."""
+    with open(split_file, 'r') as f:
+        return np.array(f.read().split(), dtype=np.int64)
+
+
+class KittiCatalog():
+    """Frames of a KITTI training or testing directory, paired by frame id.
+
+    ids is the sorted array of frame ids, names(kind) the file names of kind ('image', 'label', 'calib')
+    aligned with ids, '' where a frame has no such file. Frames are only paired by id, an extra or
+    missing file can not shift the others.
+    """
+    def __init__(self, root:str, ids:np.ndarray, names:Dict[str, np.ndarray]):
+        self.root = root
+        self.ids = ids
+        self._names = names
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _state_key(root:str)->str:
+        """mtimes of the sub directories, they change whenever a file is added, removed or renamed."""
+        state = []
+        for kind, (directory, _) in CATALOG_DIRECTORIES.items():
+            path = os.path.join(root, directory)
+            state.append(f"{kind}:{os.stat(path).st_mtime_ns if os.path.isdir(path) else -1}")
+        return os.path.abspath(root) + "|" + ",".join(state)
+
+    @classmethod
+    def build(cls, root:str)->'KittiCatalog':
+        """Scan the sub directories of root, files whose stem is not an integer are ignored."""
+        by_kind = {}
+        for kind, (directory, extensions) in CATALOG_DIRECTORIES.items():
+            files:Dict[int, str] = {}
+            path = os.path.join(root, directory)
+            if os.path.isdir(path):
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        stem, extension = os.path.splitext(entry.name)
+                        if extension.lower() in extensions and stem.isdigit():
+                            frame_id = int(stem)
+                            if frame_id not in files or entry.name < files[frame_id]:
+                                files[frame_id] = entry.name
+            by_kind[kind] = files
+        ids = np.array(sorted(set().union(*by_kind.values())), dtype=np.int64)
+        names = {kind: np.array([files.get(frame_id, '') for frame_id in ids.tolist()], dtype=str)
+                 for kind, files in by_kind.items()}
+        return cls(root, ids, names)
+
+    @classmethod
+    def open(cls, root:str, index_file:Optional[str]=None)->'KittiCatalog':
+        """Load the catalog from index_file if it is up to date, otherwise scan root (and save the index)."""
+        if index_file is None:
+            return cls.build(root)
+        key = cls._state_key(root)
+        if os.path.isfile(index_file):
+            with np.load(index_file) as content:
+                if str(content['key']) == key:
+                    return cls(root, content['ids'], {kind: content[kind] for kind in CATALOG_DIRECTORIES})
+        catalog = cls.build(root)
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            arrays:Dict[str, Any] = dict(key=key, ids=catalog.ids, **catalog._names)
+            np.savez(f, **arrays)
+        os.replace(tmp_file, index_file)
+        return catalog
+
+    def directory(self, kind:str)->str:
+        return os.path.join(self.root, CATALOG_DIRECTORIES[kind][0])
+
+    def names(self, kind:str)->List[str]:
+        return self._names[kind].tolist()
+
+    def paths(self, kind:str)->List[str]:
+        directory = self.directory(kind)
+        return [os.path.join(directory, name) if name else '' for name in self._names[kind].tolist()]
+
+    def has(self, kind:str)->np.ndarray:
+        return self._names[kind] != ''
+
+    def subset(self, index:np.ndarray)->'KittiCatalog':
+        """Catalog of the frames at index (integer or boolean array)."""
+        return KittiCatalog(self.root, self.ids[index], {kind: names[index] for kind, names in self._names.items()})
+
+    def labeled(self)->'KittiCatalog':
+        """Frames having both an image and a label file."""
+        return self.subset(self.has('image') & self.has('label'))
+
+    def select_ids(self, ids:np.ndarray, strict:bool=False)->'KittiCatalog':
+        """Frames with the given ids, in catalog (sorted id) order.
+        Ids not in the catalog are ignored, or raise a KeyError if strict."""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        position = np.clip(np.searchsorted(self.ids, ids), 0, max(len(self.ids) - 1, 0))
+        found = self.ids[position] == ids if len(self.ids) else np.zeros(len(ids), dtype=bool)
+        if strict and not found.all():
+            raise KeyError(f"{int((~found).sum())} frame ids are not in {self.root}, e.g. {ids[~found][:5].tolist()}")
+        return self.subset(position[found])
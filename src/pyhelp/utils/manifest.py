@@ -0,0 +1,153 @@
+"""
+    Per-frame manifest for incremental dataset conversion: the converted record of every frame is cached
+    with the signature of its source files, only added or changed frames are converted again.
+"""
+import hashlib
+import os
+import pickle
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+
+def file_signature(path:str)->List[int]:
+    """[mtime_ns, size] of the file."""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def file_digest(path:str)->str:
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+class FrameManifest():
+    """Cache of converted frame records keyed by frame, validated with the label file
+    (mtime, size, content hash) and the image file (mtime, size).
+
+    A frame whose label mtime or size changed but whose content hash is the same is still a hit,
+    so touching files does not trigger a re-conversion.
+    Each frame owns a list of ids (e.g. COCO annotation ids, see ids): ids of unchanged frames are kept,
+    a changed frame reuses its old ids first, new ids are taken above the highest id ever given,
+    so ids are never reused by another frame.
+    The manifest also remembers the outputs it produced, so a refresh without any change can skip
+    rewriting them (see is_output_current).
+    """
+    VERSION = 2
+
+    def __init__(self, manifest_file:str, options:Optional[Dict[str, Any]]=None):
+        """
+        manifest_file: pickle file of the manifest, created on save
+        options: conversion options the records depend on, a manifest written with other options is discarded
+        """
+        self.manifest_file = manifest_file
+        self.options = options or {}
+        self.entries:Dict[str, Dict[str, Any]] = {}
+        self.outputs:Dict[str, Dict[str, Any]] = {} # output file -> file signature and selection digest
+        self.next_id = 0
+        self._changed = False # needs saving
+        self._num_removed = 0 # frames dropped by prune
+        self._checked = False # records was called, num_converted is known
+        self.num_hits = 0
+        self.num_converted = 0
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, 'rb') as f:
+                content = pickle.load(f)
+            if content.get("version") == self.VERSION and content.get("options") == self.options:
+                self.entries = content["entries"]
+                self.outputs = content.get("outputs", {})
+                self.next_id = content["next_id"]
+
+    def lookup(self, key:str, label_path:str, image_path:str)->Optional[Any]:
+        """The cached record of the frame, None if it is new or its files changed."""
+        entry = self.entries.get(key)
+        if entry is None or entry["image"] != file_signature(image_path):
+            return None
+        label_signature = file_signature(label_path)
+        if entry["label"][:2] != label_signature:
+            digest = file_digest(label_path)
+            if entry["label"][2] != digest:
+                return None
+            entry["label"] = [*label_signature, digest]
+            self._changed = True
+        return entry["record"]
+
+    def store(self, key:str, label_path:str, image_path:str, record:Any):
+        """Cache the record of the frame, the ids of the frame are kept."""
+        ids = self.entries[key]["ids"] if key in self.entries else []
+        self.entries[key] = dict(label=[*file_signature(label_path), file_digest(label_path)],
+                                 image=file_signature(image_path), record=record, ids=ids)
+        self._changed = True
+
+    def ids(self, key:str, count:int)->List[int]:
+        """count stable ids of the stored frame key, its previous ids are reused first."""
+        entry = self.entries[key]
+        if len(entry["ids"]) != count:
+            num_new = max(count - len(entry["ids"]), 0)
+            entry["ids"] = entry["ids"][:count] + list(range(self.next_id, self.next_id + num_new))
+            self.next_id += num_new
+            self._changed = True
+        return entry["ids"]
+
+    def prune(self, keys:Iterable[str]):
+        """Drop the frames which are not in keys (removed from the dataset), their ids are retired."""
+        keys = set(keys)
+        num_entries = len(self.entries)
+        self.entries = {key: entry for key, entry in self.entries.items() if key in keys}
+        if len(self.entries) != num_entries:
+            self._num_removed += num_entries - len(self.entries)
+            self._changed = True
+
+    def records(self, keys:Sequence[str], label_paths:Sequence[str], image_paths:Sequence[str],
+                convert:Callable[[List[int]], Iterable[Any]])->Iterator[Any]:
+        """Check every frame against the manifest (num_converted and num_hits are set on return)
+        and return an iterator of the records of every frame in order.
+
+        convert: called once with the indices of the frames to convert, returns their records in order
+        """
+        cached = [self.lookup(key, label_path, image_path)
+                  for key, label_path, image_path in zip(keys, label_paths, image_paths)]
+        todo = [i for i, record in enumerate(cached) if record is None]
+        self.num_converted = len(todo)
+        self.num_hits = len(keys) - len(todo)
+        self._checked = True
+        return self._merge(keys, label_paths, image_paths, cached, todo, convert)
+
+    def _merge(self, keys, label_paths, image_paths, cached, todo, convert):
+        converted = iter(convert(todo)) if todo else iter(())
+        for i, record in enumerate(cached):
+            if record is None:
+                record = next(converted)
+                self.store(keys[i], label_paths[i], image_paths[i], record)
+            yield record
+
+    def _selection_digest(self, selection:Any)->str:
+        return hashlib.blake2b(repr(selection).encode(), digest_size=16).hexdigest()
+
+    def is_output_current(self, output_file:str, selection:Any)->bool:
+        """True if nothing changed since output_file was written from this manifest with the same
+        selection (e.g. the selected frame keys and output options) and the file was not modified.
+
+        Decided from the frames records found added or changed (it must be called first) and the frames
+        removed by prune, before any record is converted. False if records was not called.
+        """
+        output = self.outputs.get(output_file)
+        unchanged = self._checked and self.num_converted == 0 and self._num_removed == 0
+        return (unchanged and output is not None and os.path.isfile(output_file)
+                and output["signature"] == file_signature(output_file)
+                and output["selection"] == self._selection_digest(selection))
+
+    def set_output(self, output_file:str, selection:Any):
+        """Remember that output_file was written with the current records and the selection."""
+        self.outputs[output_file] = dict(signature=file_signature(output_file),
+                                         selection=self._selection_digest(selection))
+        self._changed = True
+
+    def save(self):
+        """Write the manifest file if anything changed."""
+        if not self._changed:
+            return
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(dict(version=self.VERSION, options=self.options, entries=self.entries,
+                             outputs=self.outputs, next_id=self.next_id), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.manifest_file)
+        self._changed = False
@@ -0,0 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+def default_chunksize(num_items:int, workers:int)->int:
+    """About four chunks per worker, bounded so that progress stays visible on large inputs."""
+    return max(1, min(256, num_items // (workers * 4)))
+
+
+def ordered_map(func, items, workers:int=0, chunksize=None):
+    """Map func over items with a process pool, yielding the results in the order of items.
+
+    Args:
+        func: the function, module level (picklable) when workers > 1
+        items: iterable of single arguments
+        workers (int): number of worker processes, 0 or 1 runs in this process
+        chunksize (int, optional): items sent to a worker per task, see default_chunksize
+
+    Example:
+        for record in ordered_map(functools.partial(read_frame, root), frames, workers=8):
+            ...
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    items = list(items)
+    if chunksize is None:
+        chunksize = default_chunksize(len(items), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(func, items, chunksize=chunksize)
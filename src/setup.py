@@ -23,6 +23,8 @@ setup(name='pyhelp',
 			"pyhelp.kitti2coco=pyhelp.cli.kitti2coco:main",
 			"pyhelp.kitti2custom=pyhelp.cli.kitti2custom:main",
 			"pyhelp.mmdet2kitti=pyhelp.cli.mmdet2kitti:main",
+			"pyhelp.convert=pyhelp.cli.engine:main",
+			"pyhelp.bench_compare=pyhelp.cli.bench_compare:main",
 			"pyhelp=pyhelp.cli.introduction:main"
         ],
     },
@@ -0,0 +1,64 @@
+import json
+import os
+import struct
+import zlib
+
+from pyhelp.cli.kitti2custom import kitti2custom
+
+LABEL = "Car 0.00 0 0.00 {} 20.00 30.00 40.00 1.50 1.60 3.90 1.00 1.50 20.00 0.00\n"
+
+
+def _png(path, width=64, height=32):
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = b"IHDR" + ihdr
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + chunk + struct.pack(">I", zlib.crc32(chunk)))
+
+
+def _make_frame(root, frame_id, left):
+    _png(os.path.join(root, "image_2", "%06d.png" % frame_id))
+    with open(os.path.join(root, "label_2", "%06d.txt" % frame_id), "w") as f:
+        f.write(LABEL.format(left))
+
+
+def _convert(root, tmp_path, output_count=100):
+    output_file = str(tmp_path / "custom.json")
+    kitti2custom(root, output_file, output_count=output_count, manifest=str(tmp_path / "manifest.pkl"))
+    with open(output_file) as f:
+        return json.load(f)
+
+
+def _kitti(tmp_path, num_frames=3):
+    root = str(tmp_path / "training")
+    os.makedirs(os.path.join(root, "image_2"))
+    os.makedirs(os.path.join(root, "label_2"))
+    for frame_id in range(num_frames):
+        _make_frame(root, frame_id, 10.0)
+    return root
+
+
+def test_edited_label_rewrites_output(tmp_path):
+    root = _kitti(tmp_path)
+    assert _convert(root, tmp_path)[1]["ann"]["bboxes"] == [[10.0, 20.0, 30.0, 40.0]]
+    _make_frame(root, 1, 12.5)
+    assert _convert(root, tmp_path)[1]["ann"]["bboxes"] == [[12.5, 20.0, 30.0, 40.0]]
+
+
+def test_added_frame_rewrites_output(tmp_path):
+    root = _kitti(tmp_path)
+    assert len(_convert(root, tmp_path)) == 3
+    _make_frame(root, 3, 10.0)
+    assert len(_convert(root, tmp_path)) == 4
+
+
+def test_other_frame_selection_rewrites_output(tmp_path):
+    root = _kitti(tmp_path)
+    assert len(_convert(root, tmp_path)) == 3
+    assert len(_convert(root, tmp_path, output_count=2)) == 2
+
+
+def test_unchanged_output_is_kept(tmp_path, capsys):
+    root = _kitti(tmp_path)
+    first = _convert(root, tmp_path)
+    assert _convert(root, tmp_path) == first
+    assert "up to date" in capsys.readouterr().out